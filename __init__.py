@@ -58,14 +58,18 @@ These commands are not implemented for our devices::
 from datetime import datetime
 from glob import glob
 from math import ceil, log, sqrt
-from numpy import array
+from numpy import empty, nan
 from os.path import basename
 from serial import Serial
 from time import sleep, time
 import logging
+import threading
 
 from Electronics.Instruments import PowerMeter
-from support import nearest_index
+from Electronics.Instruments.Radipower.reader import LineReader
+from Electronics.Instruments.Radipower.sysfs import port_key, usb_ports
+from Electronics.Instruments.Radipower.timing import CommandStats
+from Electronics.Instruments.Radipower import tracing
 logger = logging.getLogger(__name__)
 
 sqrt10 = sqrt(10)
@@ -122,10 +126,18 @@ class Radipower(PowerMeter, Serial):
   acq_speeds = {"RPR1018": [1000],        # kSps
                 "RPR1006": [10,100,1000],
                 "RPR2006": [20,100,1000]}
+  baud_codes = {0: 57600, 1: 115200, 2: 230400, 3: 460800} # bps
+  min_read_time = 0.01 # s; the fastest a head returns readings is ~100 S/s
+  _tunings = {} # set_averaging() choices keyed by model and target
+  # settings whose values are kept in the 'settings' dict
+  cached_settings = ("ACQ_SPEED", "BAUD", "FILTER", "POWER_UNIT", "VBW")
   assigned = {}
+  assigned_lock = threading.Lock() # heads may be initialized in parallel
   
   def __init__(self, device="/dev/ttyUSB0", baud=115200,
-               timeout=1, writeTimeout=1, Sps=1000, filtercode=1):
+               timeout=1, writeTimeout=1, Sps=1000, filtercode=1,
+               cache=None, verify=False, timing=None, trace=4096,
+               verbose=False):
     """
     The 'baud' argument is provided to compensate for a possible difference
     between the Radipower BAUD rate andthe computer BAUD rate.  Basically,
@@ -146,10 +158,37 @@ class Radipower(PowerMeter, Serial):
     
     @param Sps : ADC samples per second
     @type  Sps : int
+    
+    @param cache : source of model, versions and frequency range
+    @type  cache : cache.IdentityCache
+    
+    @param verify : check cached identity against the head in background
+    @type  verify : bool
+    
+    @param timing : measured read times of known heads, updated as we go
+    @type  timing : timing.TimingStore
+    
+    @param trace : number of exchanges kept in the trace buffer; 0 for none
+    @type  trace : int
+    
+    @param verbose : log every exchange at DEBUG level
+    @type  verbose : bool
     """
     mylogger = logging.getLogger(logger.name+".Radipower")
     Serial.__init__(self, device, baud,
                           timeout=timeout, writeTimeout=writeTimeout)
+    # serializes command/reply exchanges from different threads
+    self._lock = threading.RLock()
+    self._reader = LineReader(self)
+    self.settings = {}
+    self.timing = None
+    self._stats = CommandStats()
+    self.verbose = verbose
+    if trace:
+      self.trace = tracing.TraceBuffer(trace)
+    else:
+      self.trace = None
+    self._status = tracing.OK
     sleep(0.02)
     self.name = basename(device)
     PowerMeter.__init__(self, self.name)
@@ -159,20 +198,21 @@ class Radipower(PowerMeter, Serial):
     self._attributes_.append('logger')
     if self.get_ID():
       if self.ID:
-        if Radipower.assigned.has_key(self.ID):
-          self.logger.warning("__init__: %s already assigned as Radipower %d",
-                              device, found)
-        else:
-          Radipower.assigned[IDs[self.ID]] = device # show device as assigned
+        with Radipower.assigned_lock:
+          if Radipower.assigned.has_key(IDs[self.ID]):
+            self.logger.warning("__init__: %s already assigned as Radipower %d",
+                                device, IDs[self.ID])
+          else:
+            Radipower.assigned[IDs[self.ID]] = device # show device as assigned
         self.name = "PM%02d" % IDs[self.ID]
         self._attributes_.append('name')
-        self.identify()
+        # f_min and f_max replace class PowerMeter defaults
+        self.load_identity(cache, verify)
+        if timing:
+          self.timing = timing.model(self.ID)
         self._attributes_.append('model')
         self._attributes_.append("HWversion"),
         self._attributes_.append("SWversion")
-        # These replace class PowerMeter defaults
-        self.f_min = float(self.ask("FREQUENCY? MIN")[:-4])/1.e6 # GHz
-        self.f_max = float(self.ask("FREQUENCY? MAX")[:-4])/1.e6 # GHz
         self.p_min = -55 # dBm
         self.p_max = +10 # dBm
         self.auto_averaging() # sets num_avg
@@ -184,15 +224,18 @@ class Radipower(PowerMeter, Serial):
           self.units = self.ask("POWER_UNIT?")
         self.trigmode = None # triggering mode
         # use highest sampling speed
-        try:
-          self.ask("ACQ_SPEED "+str(Sps))
-        except RadipowerError as details:
-          if str(details.message) == 'is not a valid command':
+        acq_reply, filter_reply = self.ask_many(["ACQ_SPEED "+str(Sps),
+                                                 "FILTER "+str(filtercode)],
+                                                raise_errors=False)
+        if isinstance(acq_reply, RadipowerError):
+          if str(acq_reply.message) == 'is not a valid command':
             # for old model radipowers
             pass
           else:
-            raise RuntimeError(details)
-        self.ask("FILTER "+str(filtercode))
+            raise RuntimeError(acq_reply)
+        if isinstance(filter_reply, RadipowerError):
+          raise filter_reply
+        self._cache_timing_settings()
         self.logger.debug(" initialized %s", device[5:])
       else:
         raise RadipowerError(self.ID, 'is not a valid response to ID_NUMBER?')
@@ -216,30 +259,289 @@ class Radipower(PowerMeter, Serial):
   def identify(self):
     """
     """
-    response = self.ask("*IDN?")
+    response, self.HWversion, self.SWversion = self.ask_many(
+                                    ["*IDN?", "VERSION_HW?", "VERSION_SW?"])
     index = response.index('RPR')
     self.model = response[index:index+8]
-    self.HWversion = self.ask("VERSION_HW?")
-    self.SWversion = self.ask("VERSION_SW?")
     return self.model, self.HWversion, self.SWversion
 
+  def get_freq_range(self):
+    """
+    Gets the frequency range of the head in GHz
+    """
+    f_min, f_max = self.ask_many(["FREQUENCY? MIN", "FREQUENCY? MAX"])
+    self.f_min = parse_frequency(f_min)
+    self.f_max = parse_frequency(f_max)
+    return self.f_min, self.f_max
+
+  def load_identity(self, cache=None, verify=False):
+    """
+    Sets model, HWversion, SWversion, f_min and f_max
+    
+    If the head is in the cache no commands are sent.  With 'verify' the
+    cached values are checked against the head in a background thread and
+    the cache entry is replaced if they differ.
+    
+    @param cache : identities of known heads
+    @type  cache : cache.IdentityCache
+    
+    @param verify : check the cached values in background
+    @type  verify : bool
+    """
+    if cache:
+      entry = cache.get(self.ID)
+    else:
+      entry = None
+    if entry:
+      self.logger.debug("load_identity: %s from cache", self.name)
+      for field in cache.fields:
+        setattr(self, field, entry[field])
+      if verify:
+        thread = threading.Thread(target=self._verify_identity, args=(cache,),
+                                  name=self.name+"-verify")
+        thread.daemon = True
+        thread.start()
+    else:
+      self.identify()
+      self.get_freq_range()
+      if cache:
+        cache.put(self.ID, **self._identity(cache))
+
+  def _identity(self, cache):
+    """
+    Returns the cacheable attributes as a dict
+    """
+    return dict([(field, getattr(self, field)) for field in cache.fields])
+
+  def _verify_identity(self, cache):
+    """
+    Replaces the cache entry if the head does not match it
+    """
+    cached = self._identity(cache)
+    try:
+      self.identify()
+      self.get_freq_range()
+    except Exception, details:
+      self.logger.error("_verify_identity: %s failed: %s", self.name, details)
+      return
+    current = self._identity(cache)
+    if current != cached:
+      self.logger.warning("_verify_identity: %s was cached as %s; is %s",
+                          self.name, cached, current)
+      cache.put(self.ID, **current)
+
   def ask(self, command):
     """
+    Sends a command and returns the reply
+    """
+    with self._lock:
+      start = time()
+      self.send_command(command)
+      try:
+        return self.get_reply(command)
+      finally:
+        self._record(command, start)
+
+  def _record(self, command, start, timing=True, value=nan):
+    """
+    Records the round trip time of a command
+    
+    The time goes into the command statistics, the trace buffer and, for
+    POWER? and if 'timing' is True, into the timing model.  Nothing is sent
+    to the head, since other replies may still be in flight.
+    """
+    now = time()
+    elapsed = now-start
+    verb = command.partition(" ")[0].upper()
+    self._stats.record(verb, elapsed)
+    if self.trace:
+      self.trace.add(now, verb, elapsed, value, self._status)
+    self._status = tracing.OK
+    if timing and self.timing and verb == "POWER?":
+      key = self._timing_key()
+      if key:
+        self.timing.record(key, elapsed)
+
+  def set_verbose(self, verbose=True):
+    """
+    Turns logging of every exchange at DEBUG level on or off
+    
+    Normally exchanges are only recorded in the trace buffer, which costs
+    much less than logging them.
+    """
+    self.verbose = verbose
+
+  def dump_trace(self, filename=None):
+    """
+    Returns the trace records, oldest first, and optionally saves them
+    
+    See tracing.TraceBuffer for the record layout.
+    
+    @param filename : .npy file to write
+    @type  filename : str
+    """
+    if not self.trace:
+      return None
+    with self._lock:
+      if filename:
+        self.trace.save(filename)
+      return self.trace.dump()
+
+  def stats(self, reset=False):
+    """
+    Returns command counts, latencies and error counts
+    
+    An example::
+      {"verbs":  {"POWER?": {"count": 1200, "errors": 1, "mean": 0.0105,
+                             "p50": 0.0102, "p90": 0.0113, "p99": 0.0131}},
+       "errors": {"ERROR 1": 1}}
+    Latencies are in s.  Errors are keyed by the code in the reply as sent,
+    e.g. 'ERROR 1' or 'ERROR_602', or 'NO_REPLY' if the head did not answer
+    in time.
+    
+    @param reset : clear the counters after reading them
+    @type  reset : bool
+    """
+    with self._lock:
+      summary = self._stats.summary()
+      if reset:
+        self._stats.reset()
+    return summary
+
+  def send_command(self, command):
+    """
+    Writes a command without waiting for the reply
+    
+    The caller must hold the head's lock until the reply has been read with
+    get_reply().
+    """
+    if self.verbose:
+      self.logger.debug("ask: '%s'", command)
+    self.write(command+'\n')
+
+  def get_reply(self, command):
+    """
+    Reads and checks the reply to a command sent with send_command()
+    """
+    return self._check_reply(command, self._reader.readline())
+
+  def get_power_reply(self):
+    """
+    Reads the reply to a POWER? command and returns the reading in dBm
+    
+    The reading is parsed in the line reader's buffer without building a
+    string.  A reply which is neither a reading nor an error message raises
+    ValueError.
+    """
+    reading = self._reader.read_power()
+    if reading == None:
+      response = self._check_reply("POWER?", self._reader.last_line())
+      if response:
+        self._stats.error("POWER?", "BAD_REPLY")
+        self._status = tracing.ERROR
+      raise ValueError("'%s' is not a valid reading" % response)
+    return reading
+
+  def _check_reply(self, command, response):
+    """
+    Returns the response or raises an exception if it is an error
+    
     An example of 'parts'::
       ['ERROR 1', '[ACQ_SPEED 20]', '']
     """
-    self.logger.debug("ask: '%s'", command)
-    self.write(command+'\n')
-    response = self.readline().strip()
-    self.logger.debug("ask: response: '%s'", response)
-    parts = response.split(";")
-    self.logger.debug("ask: parts: %s", parts)
-    if parts[0][:5] == "ERROR":
+    if self.verbose:
+      self.logger.debug("ask: response: '%s'", response)
+    if not response:
+      self._stats.error(command.partition(" ")[0].upper(), "NO_REPLY")
+      self._status = tracing.NO_REPLY
+      return response
+    elif response[:5] == "ERROR":
+      parts = response.split(";")
+      if self.verbose:
+        self.logger.debug("ask: parts: %s", parts)
+      self._stats.error(command.partition(" ")[0].upper(), parts[0])
+      self._status = tracing.ERROR
       if len(parts) == 1:
         parts.append(command)
       self._IO_error(parts)
     else:
+      self._note_setting(command, response)
       return response
+
+  def _note_setting(self, command, response):
+    """
+    Updates the settings cache after a successful command
+    
+    'FILTER 3' stores '3' and 'FILTER?' stores the reply.
+    """
+    verb, sep, argument = command.partition(" ")
+    verb = verb.upper()
+    if verb[-1:] == "?":
+      if not argument and verb[:-1] in self.cached_settings:
+        self.settings[verb[:-1]] = response
+    elif argument and verb in self.cached_settings:
+      self.settings[verb] = argument.strip().upper()
+
+  def get_setting(self, name):
+    """
+    Returns a device setting, asking the head only if it is not cached
+    
+    @param name : one of 'cached_settings'
+    @type  name : str
+    """
+    try:
+      return self.settings[name]
+    except KeyError:
+      return self.ask(name+"?")
+
+  def refresh(self):
+    """
+    Discards the settings cache and reads the settings from the head
+    
+    Settings which the head does not support are left out.
+    """
+    with self._lock:
+      self.settings.clear()
+      self.ask_many([name+"?" for name in self.cached_settings],
+                    raise_errors=False)
+      self._cache_timing_settings()
+    self.f_cal = None
+    return dict(self.settings)
+
+  def ask_many(self, commands, raise_errors=True):
+    """
+    Sends several commands in one write and returns the replies in order
+    
+    This costs about one serial turnaround instead of one per command.  All
+    the replies are read before any error is raised so that the head is left
+    ready for the next command.  An error reply is mapped to its command by
+    _IO_error() just as in ask().
+    
+    @param commands : commands without line terminators
+    @type  commands : list of str
+    
+    @param raise_errors : raise the first error; else return it as the reply
+    @type  raise_errors : bool
+    
+    @return: list of replies
+    """
+    with self._lock:
+      if self.verbose:
+        self.logger.debug("ask_many: %s", commands)
+      start = time()
+      self.write("".join([command+'\n' for command in commands]))
+      replies = []
+      for command in commands:
+        try:
+          replies.append(self.get_reply(command))
+        except RadipowerError, details:
+          replies.append(details)
+        self._record(command, start)
+    if raise_errors:
+      for reply in replies:
+        if isinstance(reply, RadipowerError):
+          raise reply
+    return replies
   
   def _IO_error(self, parts):
     """
@@ -268,21 +570,20 @@ class Radipower(PowerMeter, Serial):
     """
     Gets or sets the calibration frequency
     
-    This is only useful when measuring CW signals, not noise
+    This is only useful when measuring CW signals, not noise.  The frequency
+    is only asked for if it has not been set or read before.
 
     @param freq : frequency in GHz
     @type  freq : float
     """
     if freq == None:
-      suffix = "?"
+      if getattr(self, "f_cal", None) != None:
+        return self.f_cal
+      self.f_cal = parse_frequency(self.ask("FREQUENCY?"))
     else:
       f = int(round(freq*1e9))
-      suffix = " "+str(f)+" Hz"
-    response = self.ask("FREQUENCY"+suffix)
-    if freq == None:
-      self.f_cal = float(response[:-4])/1.e9
-    else:
-      self.f_cal = f
+      self.ask("FREQUENCY "+str(f)+" Hz")
+      self.f_cal = freq
     self._add_attr("f_cal")
     return self.f_cal
 
@@ -301,18 +602,16 @@ class Radipower(PowerMeter, Serial):
     """
     returns sampling rate
     """
+    return Radipower.baud_codes[self.baud_code()]
+
+  def baud_code(self):
+    """
+    returns the BAUD code; 1 if the head does not support the command
+    """
     try:
-      code = self.ask('BAUD?')
-      if code == '0':
-        return 57600
-      elif code == '1':
-        return 115200
-      elif code == '2':
-        return 230400
-      elif code == '3':
-        return 460800
-    except RadipowerError:
-      return 115200
+      return int(self.get_setting('BAUD'))
+    except (RadipowerError, ValueError):
+      return 1
 
   def calc_read_speed(self):
     """
@@ -320,34 +619,95 @@ class Radipower(PowerMeter, Serial):
     
     See e-mail 04/29/2016 at 01:46 AM Jeffrey Westgeest
     """
-    # com time to send command and get reply
-    bitrate = self.get_baud_rate() # b/s
-    byterate = bitrate/10
-    com_bytes = 7+11 # command and reply
-    com_time = float(com_bytes)/byterate
-    self.logger.debug("calc_read_speed: com time per reading = %f", com_time)
-    # single sample time
     try:
-      sample_rate = int(self.ask("ACQ_SPEED?"))
+      sample_rate = int(self.get_setting("ACQ_SPEED"))
     except RadipowerError:
       sample_rate = 1000
-    sample_time = 1./sample_rate
-    self.logger.debug("calc_read_speed: sample time = %f", sample_time)
-    # number averaged
     samples_averaged = self.get_samples_averaged()
     self.logger.debug("calc_read_speed: %d samples averaged", samples_averaged)
-    # measurement rate
-    reading_time = sample_time * samples_averaged
-    self.logger.debug("calc_read_speed: %f s/S", reading_time)
-    measurement_rate = reading_time+com_time
-    return measurement_rate
+    return self.predict_read_time(samples_averaged, sample_rate,
+                                  self.baud_code())
+
+  def _cache_timing_settings(self):
+    """
+    Puts FILTER, ACQ_SPEED and BAUD into the settings cache
+    
+    The timing key is made from these and is needed while POWER? replies
+    may be in flight, when nothing can be asked.  A setting which the head
+    does not support gets the value the head behaves as having.
+    """
+    with self._lock:
+      missing = [name for name in ("FILTER", "ACQ_SPEED", "BAUD")
+                 if not self.settings.has_key(name)]
+      if missing:
+        self.ask_many([name+"?" for name in missing], raise_errors=False)
+      self.settings.setdefault("ACQ_SPEED", "1000")
+      self.settings.setdefault("BAUD", "1")
+
+  def _timing_key(self, filtercode=None, acq_speed=None, baud=None):
+    """
+    Returns the timing model key for the given or the current settings
+    
+    Current settings are only taken from the cache, never asked for; if one
+    is not cached the key is None.
+    """
+    if filtercode == None:
+      filtercode = self.settings.get("FILTER")
+    if acq_speed == None:
+      acq_speed = self.settings.get("ACQ_SPEED")
+    if baud == None:
+      baud = self.settings.get("BAUD")
+    if None in (filtercode, acq_speed, baud):
+      return None
+    return "%s/%s/%s" % (filtercode, acq_speed, baud)
+
+  def read_time(self, p=50, filtercode=None, acq_speed=None, baud=None):
+    """
+    Measured time in s for one reading, or None if there are too few
+    
+    @param p : percentile, e.g. 99 for the time within which 99% of readings
+               are returned
+    @type  p : float
+    
+    Without other arguments the current settings are used.
+    """
+    key = self._timing_key(filtercode, acq_speed, baud)
+    if not self.timing or not key:
+      return None
+    return self.timing.read_time(key, p)
+
+  @staticmethod
+  def predict_read_time(samples, acq_speed, baud):
+    """
+    Time in s for one reading according to the vendor's model
+    
+    The time is that for sending the command and reply over the serial link
+    plus that for taking the samples, but no less than 'min_read_time'.  The
+    sum alone would allow some 640 S/s at FILTER 1, well beyond the ~100 S/s
+    a head can actually return.
+    
+    @param samples : number of samples averaged
+    @type  samples : int
+    
+    @param acq_speed : ACQ_SPEED in kS/s
+    @type  acq_speed : int
+    
+    @param baud : BAUD code
+    @type  baud : int
+    """
+    byterate = Radipower.baud_codes[baud]/10
+    com_bytes = 7+11 # command and reply
+    com_time = float(com_bytes)/byterate
+    sample_time = 1./(acq_speed*1000)
+    return max(sample_time*samples + com_time, Radipower.min_read_time)
 
   def set_acq_speed(self, speed):
     """
     """
     if self.model[:7] == 'RPR1018':
       self.acq_speed = 1000
-    elif speed in Radipower.acq_speeds[self.model][:7]:
+      self.settings["ACQ_SPEED"] = "1000" # fixed; not a valid command
+    elif speed in Radipower.acq_speeds[self.model[:7]]:
       response = self.ask('ACQ_SPEED '+str(speed))
       return response
     else:
@@ -362,8 +722,8 @@ class Radipower(PowerMeter, Serial):
     t0 = time()
     if self.model[:7] != 'RPR1018':
       self.logger.info("get_read_speed: ACQ_SPEED is %s",
-                       self.ask("ACQ_SPEED?"))
-    self.logger.info("get_read_speed: FILTER %s", self.ask("FILTER?"))
+                       self.get_setting("ACQ_SPEED"))
+    self.logger.info("get_read_speed: FILTER %s", self.get_setting("FILTER"))
     for i in range(100):
       x = self.ask('POWER?')
     return (time()-t0)/100
@@ -445,22 +805,75 @@ class Radipower(PowerMeter, Serial):
     command has been given. Depending on the filter setting, the RadiPower 
     performs the required number of measurements and returns the RMS value.
     """
-    self.reading = float(self.ask("POWER?")[:-4])
-    self.logger.debug("power: reading is %6.2f", self.reading)
+    with self._lock:
+      start = time()
+      self.send_command("POWER?")
+      reading = nan
+      try:
+        reading = self.get_power_reply()
+      finally:
+        self._record("POWER?", start, value=reading)
+      self.reading = reading
+    if self.verbose:
+      self.logger.debug("power: reading is %6.2f", self.reading)
     self._add_attr("power")
     return self.reading
 
+  def power_burst(self, n, depth=4):
+    """
+    Takes 'n' readings as fast as the head and the link allow
+    
+    Up to 'depth' POWER? commands are kept in flight so the head does not
+    wait for the next command after each reply.  Each time stamp is the time
+    at which the reply was received.  A reply which is not a valid reading
+    gives NaN.
+    
+    @param n : number of readings
+    @type  n : int
+    
+    @param depth : number of POWER? commands outstanding
+    @type  depth : int
+    
+    @return: (times, readings) as float64 arrays
+    """
+    times = empty(n)
+    readings = empty(n)
+    depth = min(depth, n)
+    with self._lock:
+      previous = time()
+      self.write("POWER?\n"*depth)
+      sent = depth
+      for index in xrange(n):
+        try:
+          readings[index] = self.get_power_reply()
+        except (RadipowerError, ValueError), details:
+          self.logger.error("power_burst: %s", details)
+          readings[index] = nan
+        # in a full pipeline the time between replies is the reading time;
+        # only the first reply is a whole round trip for the timing model
+        self._record("POWER?", previous, timing=(index == 0),
+                     value=readings[index])
+        previous = times[index] = time()
+        if sent < n:
+          self.write("POWER?\n")
+          sent += 1
+    if n:
+      self.reading = readings[-1]
+      self._add_attr("power")
+    return times, readings
+
   def get_samples_averaged(self):
     """
     Number of samples averaged according to filter code
     
     If the filter code is AUTO then the effective filter code must be inferred
-    from the power level.
+    from the power level.  The last reading is used if there is one.
     """
-    self.filter = self.ask("FILTER?")
+    self.filter = self.get_setting("FILTER")
     self._add_attr("filter")
     if self.filter == "AUTO":
-      self.power()
+      if getattr(self, "reading", None) == None:
+        self.power()
       if self.reading > -20. and self.reading <= 10.:
         self.num_avg = Radipower.filtercodes[self.model[:7]][3]
       elif self.reading > -30. and self.reading <= -20.:
@@ -475,15 +888,24 @@ class Radipower(PowerMeter, Serial):
       self.num_avg = Radipower.filtercodes[self.model[:7]][int(self.filter)]
     return self.num_avg
     
-  def set_averaging(self, num, no_smear=False, min_rms=False, most=False):
+  def set_averaging(self, num=None, rate=None, noise=None, no_smear=False,
+                    min_rms=False, most=False, bauds=None):
     """
     Selects the averaging option for power meter readings
     
-    NOT FINISHED
-    
-    Sets the number of samples to average.  If no keyword argument is given,
-    the averaging option is the one which averages the number of samples which
-    is closest to num.
+    The FILTER, ACQ_SPEED and, optionally, BAUD combinations available for
+    the model are searched using the measured median reading time where
+    there is one and the model of predict_read_time() where there is not.
+    Exactly one of these selects the setting::
+      num   - number of samples to average; the nearest number available
+              unless 'no_smear' or 'min_rms' is given
+      rate  - readings per second; the most samples which can be read at
+              that rate
+      noise - reading noise relative to a single sample, i.e. 1/sqrt(N);
+              the fastest setting with noise no larger than that
+      most  - largest number of samples available
+    The choice for a given model and target is remembered, so repeated calls
+    cost only the commands which apply the setting.
     
     The acquisition speed and filter should be set in such a way that at least
     one full period of the modulation signal is measured. At 1Msps, the filter
@@ -491,52 +913,112 @@ class Radipower(PowerMeter, Serial):
     lower sampling speeds, for example 100ksps, the filter should be set to 3
     or higher to measure at least one full period of the envelope signal. 
     
-    @param num : number of samples to average; calculate if 0
+    @param num : number of samples to average
     @type  num : int
     
-    @param no_smear : if True, num is the largest < reading_time/sampling_time
+    @param rate : target reading rate in readings per second
+    @type  rate : float
+    
+    @param noise : target noise relative to one sample
+    @type  noise : float
+    
+    @param no_smear : if True, num is the largest <= the requested num
     @type  no_smear : bool
     
-    @param min_rms : if True, num is the smallest > reading_time/sampling_time
+    @param min_rms : if True, num is the smallest >= the requested num
     @type  min_rms : bool
     
     @param most: largest number of samples available
     @type  most: bool
     
+    @param bauds : BAUD codes which may be used; default the current one
+    @type  bauds : list of int
+    
     @return num_averaged
     """
-    if self.model == 'RPR2006C':
-      if num > 5000:
-        raise RadipowerError(num_averages,"averages is greater than 5000")
-      elif num > 0:
-        read_speed = self.get_read_speed() # ms
-        self.logger.debug("set_averaging: read speed = %6.3f", read_speed)
-        if read_speed < 0.5 :
-          response = self.ask("BAUD 3")           # 0.3 ms/sample
-        elif read_speed < 1:
-          response = self.ask("BAUD 2")           # 0.6 ms/sample
-        else:
-          response = self.ask("BAUD 1")           # 1.25 ms/sample
-      elif num == 0:
-        samples_per_read = read_speed*20
-        bounds = self.filter_bounds(samples_per_read)
-        if most:
-          response = self.ask("FILTER 7")
-        elif no_smear:
-          response = self.ask("FILTER "+str(bounds[0]))
-        elif min_rms:
-          response = self.ask("FILTER "+str(bounds[1]))
-        else:
-          response = self.ask("FILTER "+str(nearest_index(array(bounds), num)))
-    elif self.model == 'RPR1018A':
-      if num > 1000:
-        raise RadipowerError(num_averages,"averages is greater than 1000")
-      elif num > 0:
-        read_speed = self.get_read_speed() # ms
-        if read_speed < 1 :
-          pass
-    self.get_averaging()
-    return response
+    family = self.model[:7]
+    if bauds == None:
+      bauds = [self.baud_code()]
+    key = (family, num, rate, noise, no_smear, min_rms, most, tuple(bauds))
+    if Radipower._tunings.has_key(key):
+      filtercode, speed, baud = Radipower._tunings[key]
+    else:
+      filtercode, speed, baud = self._tune(num, rate, noise, no_smear, min_rms,
+                                           most, bauds)
+      Radipower._tunings[key] = (filtercode, speed, baud)
+    self.logger.info("set_averaging: FILTER %d, ACQ_SPEED %d, BAUD %d",
+                     filtercode, speed, baud)
+    self.apply_settings(filtercode, speed, baud)
+    return self.get_samples_averaged()
+
+  def apply_settings(self, filtercode, acq_speed, baud=None):
+    """
+    Sets FILTER, ACQ_SPEED and BAUD
+    
+    If the BAUD code changes, the computer side of the port follows the head
+    or the head would be lost.  ACQ_SPEED is not sent to RPR1018s.
+    
+    @param filtercode : FILTER code or 'AUTO'
+    @param acq_speed : ACQ_SPEED in kS/s
+    @param baud : BAUD code; default unchanged
+    """
+    if baud != None and baud != self.baud_code():
+      self.ask("BAUD "+str(baud))
+      self.baudrate = Radipower.baud_codes[baud]
+    if self.model[:7] == 'RPR1018':
+      self.ask("FILTER "+str(filtercode))
+    else:
+      self.ask_many(["ACQ_SPEED "+str(acq_speed), "FILTER "+str(filtercode)])
+
+  def _tune(self, num, rate, noise, no_smear, min_rms, most, bauds):
+    """
+    Returns the (FILTER, ACQ_SPEED, BAUD) codes meeting the target
+    
+    See set_averaging() for the arguments.  Predicted times are often equal,
+    being held to 'min_read_time', so equally fast choices are told apart by
+    the number of samples averaged and then by the higher ACQ_SPEED.
+    """
+    family = self.model[:7]
+    choices = []
+    for filtercode, samples in Radipower.filtercodes[family].items():
+      for speed in Radipower.acq_speeds[family]:
+        for baud in bauds:
+          read_time = self.read_time(50, filtercode, speed, baud) or \
+                      self.predict_read_time(samples, speed, baud)
+          choices.append((read_time, samples, filtercode, speed, baud))
+    # fastest first, then most samples, then highest ACQ_SPEED
+    fastest = lambda c: (c[0], -c[1], -c[3])
+    if most:
+      best = max(choices, key=lambda c: (c[1], -c[0], c[3]))
+    elif num != None:
+      if num > max([c[1] for c in choices]):
+        raise RadipowerError(str(num), "averages is too many for "+self.model)
+      if no_smear:
+        allowed = [c for c in choices if c[1] <= num] or choices
+      elif min_rms:
+        allowed = [c for c in choices if c[1] >= num]
+      else:
+        allowed = choices
+      best = min(allowed, key=lambda c: (abs(c[1]-num), c[0], -c[3]))
+    elif rate != None:
+      allowed = [c for c in choices if c[0] <= 1./rate]
+      if allowed:
+        best = max(allowed, key=lambda c: (c[1], -c[0], c[3]))
+      else:
+        best = min(choices, key=fastest)
+        self.logger.warning("_tune: %s cannot read %.1f/s; best is %.1f/s",
+                            self.model, rate, 1./best[0])
+    elif noise != None:
+      allowed = [c for c in choices if 1./sqrt(c[1]) <= noise]
+      if allowed:
+        best = min(allowed, key=fastest)
+      else:
+        best = max(choices, key=lambda c: (c[1], -c[0], c[3]))
+        self.logger.warning("_tune: %s cannot reach noise %f", self.model,
+                            noise)
+    else:
+      raise RadipowerError("set_averaging", "needs num, rate, noise or most")
+    return best[2], best[3], best[4]
     
     
 class RP_array(dict):
@@ -559,26 +1041,242 @@ class RP_array(dict):
     keys.sort()
     return keys
     
+class Poller(object):
+  """
+  Reads all the power meters in a dict at the same time
+  
+  'POWER?' is written to every head before any reply is read so the heads
+  measure concurrently.  The time for one epoch is then set by the slowest
+  head rather than by the sum of all the heads.
+
+  Only the head whose reply is read first gives a true round trip time, so
+  that head alone feeds its timing model, and which head is read first
+  moves on every epoch so that all the models are fed.
+  
+  Public attributes::
+    heads  - Radipower objects in the order of 'keys'
+    keys   - sorted keys of the dict, e.g. as returned by find_radipowers()
+    logger - logging.Logger object
+  """
+  def __init__(self, rp):
+    """
+    @param rp : power meters
+    @type  rp : dict of Radipower objects
+    """
+    self.logger = logging.getLogger(logger.name+".Poller")
+    self.keys = sorted(rp.keys())
+    self.heads = [rp[key] for key in self.keys]
+    self._turn = 0 # epochs read, to choose the head read first
+
+  def read(self):
+    """
+    Takes one reading from every head
+    
+    Heads which do not return a valid reading are given a reading of NaN.
+    
+    @return: (time the commands were issued, array of readings in dBm)
+    """
+    readings = empty(len(self.heads))
+    for head in self.heads:
+      head._lock.acquire()
+    try:
+      sent = []
+      for head in self.heads:
+        sent.append(time())
+        head.send_command("POWER?")
+      timestamp = time()
+      first = self._turn % len(self.heads) if self.heads else 0
+      self._turn += 1
+      for index in range(first, len(self.heads)) + range(first):
+        head = self.heads[index]
+        try:
+          head.reading = head.get_power_reply()
+        except (RadipowerError, ValueError), details:
+          self.logger.error("read: %s failed: %s", head.name, details)
+          readings[index] = nan
+        else:
+          readings[index] = head.reading
+        # replies are read in turn so later ones are upper bounds
+        head._record("POWER?", sent[index], timing=(index == first),
+                     value=readings[index])
+    finally:
+      for head in self.heads:
+        head._lock.release()
+    return timestamp, readings
+
 # ----------------------------- module methods ---------------------------------
 
-def find_radipowers():
+frequency_units = {"HZ": 1e-9, "KHZ": 1e-6, "MHZ": 1e-3, "GHZ": 1.}
+
+def parse_frequency(reply):
+  """
+  Returns a frequency reply such as '10000 kHz' in GHz
+  """
+  value, unit = reply.split()
+  try:
+    return float(value)*frequency_units[unit.upper()]
+  except KeyError:
+    raise RadipowerError(reply, "has an unknown frequency unit")
+
+def query_ID(port, baud=115200, timeout=1):
+  """
+  Returns the ID_NUMBER of the head on a port without initializing it
+  
+  This follows the vendor's connection sequence: open the port, wait 20 ms,
+  and try ID_NUMBER? up to three times.
+  
+  @return: ID_NUMBER or None if the port does not answer like a Radipower
+  """
+  try:
+    port_obj = Serial(port, baud, timeout=timeout, writeTimeout=timeout)
+  except Exception, details:
+    logger.error("query_ID: cannot open %s: %s", port, details)
+    return None
+  try:
+    sleep(0.02)
+    for retry in range(3):
+      port_obj.write("ID_NUMBER?\n")
+      response = port_obj.readline().strip()
+      if response and response[:5] != "ERROR":
+        return response
+  finally:
+    port_obj.close()
+  return None
+
+def map_ports(portmap):
+  """
+  Returns the ID_NUMBER of the head on each USB serial port
+  
+  The adapters are identified from sysfs.  Only ports whose adapter is not
+  in the port map, or has changed, are opened to ask for the ID_NUMBER, and
+  what is found is added to the map.  A rescan of a known rack is therefore
+  just a walk through /sys.
+  
+  @param portmap : learned adapter to head mapping
+  @type  portmap : cache.PortMap
+  
+  @return: dict of ID_NUMBERs keyed by device name
+  """
+  adapters = usb_ports()
+  mapping = {}
+  learned = False
+  for port in sorted(adapters.keys()):
+    usb = adapters[port]
+    key = port_key(usb)
+    ID = portmap.get(key, usb)
+    if ID == None:
+      logger.debug("map_ports: asking %s (%s) for its ID", port, key)
+      ID = query_ID(port)
+      if ID:
+        portmap.put(key, save=False, ID=ID,
+                    vendor=usb["vendor"], product=usb["product"])
+        learned = True
+    if ID:
+      mapping[port] = ID
+  if learned:
+    portmap.save()
+  logger.debug("map_ports: %s", mapping)
+  return mapping
+
+def find_radipowers(ports=None, workers=8, port_timeout=10, portmap=None,
+                    **kwargs):
   """
   Instantiates the Radipowers found and returns a dict
+  
+  The ports are opened and the heads initialized by at most 'workers' threads
+  at a time.  A port which has not been initialized after 'port_timeout'
+  seconds is abandoned so that one dead port cannot stall the whole scan.  If
+  the head on an abandoned port responds later it is closed again and its
+  entry in Radipower.assigned removed.  An abandoned thread still holds its
+  place among the 'workers' until it ends; if no place comes free within
+  'port_timeout' the remaining ports are not tried.
+  
+  @param ports : serial ports to try; default all /dev/ttyUSB*
+  @type  ports : list of str
+  
+  @param workers : maximum number of ports initialized at the same time
+  @type  workers : int
+  
+  @param port_timeout : seconds allowed for initializing one port
+  @type  port_timeout : float
+  
+  @param portmap : if given, only ports known to have Radipowers are opened
+  @type  portmap : cache.PortMap
+  
+  Other keyword arguments, e.g. 'cache', are passed to Radipower.
   """
-  ports = glob("/dev/ttyUSB*")
+  if ports == None and portmap != None:
+    ports = []
+    for port, ID in map_ports(portmap).items():
+      if IDs.has_key(ID):
+        ports.append(port)
+      else:
+        logger.warning("find_radipowers: %s has unknown ID %s", port, ID)
+  elif ports == None:
+    ports = glob("/dev/ttyUSB*")
   logger.debug("find_radipowers: found %s", ports)
-  ports.sort()
+  ports = sorted(ports)
   logger.debug("find_radipowers: ports: %s", ports)
   rp = {}
-  for port in ports:
+  lock = threading.Lock()
+  abandoned = set()
+  
+  def open_port(port):
     logger.debug(" Opening %s", port)
     try:
-      RP = Radipower(device=port)
+      RP = Radipower(device=port, **kwargs)
     except RadipowerError:
       logger.error("find_radipowers: no response from %s", port)
-    else:
-      if RP.ID != None:
+      return
+    except Exception, details:
+      logger.error("find_radipowers: cannot open %s: %s", port, details)
+      return
+    with lock:
+      if port in abandoned:
+        logger.warning("find_radipowers: %s responded after timeout", port)
+        RP.close()
+        with Radipower.assigned_lock:
+          if IDs.has_key(RP.ID) and \
+             Radipower.assigned.get(IDs[RP.ID]) == port:
+            del Radipower.assigned[IDs[RP.ID]]
+      elif RP.ID != None:
         index = IDs[RP.ID]
         rp[index] = RP
         logger.info(" Attached Radipower %d model %s", index, RP.model)
+  
+  waiting = list(ports)
+  running = {} # port: (thread, start time)
+  stalled = {} # abandoned port: thread
+  blocked = None # since when only abandoned threads have held the places
+  while waiting or running:
+    for port in stalled.keys():
+      if not stalled[port].is_alive():
+        del stalled[port]
+    while waiting and len(running)+len(stalled) < workers:
+      port = waiting.pop(0)
+      thread = threading.Thread(target=open_port, args=(port,),
+                                name="find_radipowers-"+basename(port))
+      thread.daemon = True
+      thread.start()
+      running[port] = (thread, time())
+    if waiting and not running:
+      if blocked == None:
+        blocked = time()
+      elif time()-blocked > port_timeout:
+        logger.error("find_radipowers: no worker came free for %s", waiting)
+        break
+    else:
+      blocked = None
+    sleep(0.01)
+    for port in running.keys():
+      thread, start = running[port]
+      if not thread.is_alive():
+        del running[port]
+      elif time()-start > port_timeout:
+        with lock:
+          abandoned.add(port)
+        logger.error("find_radipowers: %s timed out after %.1f s",
+                     port, port_timeout)
+        stalled[port] = thread
+        del running[port]
   return rp
@@ -0,0 +1,160 @@
+"""
+Benchmark of Radipower acquisition
+
+Replaces speed.py and speed2.py, which timed 1000 POWER? calls at one
+hand-edited setting.  This sweeps FILTER x ACQ_SPEED x BAUD x number of
+heads, reading all the heads of a sweep point together with Poller, and
+reports for each point::
+  throughput  - readings per second, all heads
+  p50/p90/p99 - epoch times in ms (one epoch reads every head once)
+  cpu         - CPU time in microseconds per reading
+  predicted   - calc_read_speed() for the first head, in ms
+The results are also written as JSON so that runs can be compared.
+
+Examples::
+  python benchmark.py --emulate=16 --heads=1,4,16 --filters=1,3,5
+  python benchmark.py --ports=/dev/ttyUSB0 --speeds=100,1000 --bauds=1
+BAUD is only swept when --bauds is given; a wrong BAUD can lock up a head.
+"""
+import json
+import logging
+import os
+import sys
+import time
+from optparse import OptionParser
+
+from numpy import array, isnan, percentile
+
+from Electronics.Instruments.Radipower import find_radipowers, Poller
+
+logger = logging.getLogger(__name__)
+
+def int_list(text):
+  """
+  converts '1,3,5' to [1, 3, 5]
+  """
+  return [int(item) for item in text.split(",") if item]
+
+def run_point(heads, filtercode, acq_speed, baud, num_readings):
+  """
+  Measures one sweep point
+
+  @param heads : Radipower objects keyed by index
+  @type  heads : dict
+
+  @return: dict of results
+  """
+  for head in heads.values():
+    head.apply_settings(filtercode, acq_speed, baud)
+  poller = Poller(heads)
+  poller.read() # first reading after a change may be slow
+  epochs = []
+  bad = 0
+  cpu_start = sum(os.times()[:2])
+  start = time.time()
+  for count in xrange(num_readings):
+    epoch_start = time.time()
+    timestamp, readings = poller.read()
+    epochs.append(time.time()-epoch_start)
+    bad += isnan(readings).sum()
+  elapsed = time.time()-start
+  cpu = sum(os.times()[:2])-cpu_start
+  epochs = array(epochs)*1000
+  total = num_readings*len(heads)
+  first = heads[sorted(heads.keys())[0]]
+  return {"heads":      len(heads),
+          "filter":     filtercode,
+          "acq_speed":  acq_speed,
+          "baud":       first.baud_code(),
+          "readings":   total,
+          "bad":        int(bad),
+          "throughput": total/elapsed,
+          "p50":        percentile(epochs, 50),
+          "p90":        percentile(epochs, 90),
+          "p99":        percentile(epochs, 99),
+          "cpu":        1e6*cpu/total,
+          "predicted":  1000*first.calc_read_speed()}
+
+def sweep(rp, head_counts, filters, speeds, bauds, num_readings):
+  """
+  Runs every sweep point and returns the list of results
+  """
+  keys = sorted(rp.keys())
+  results = []
+  for num_heads in head_counts:
+    if num_heads > len(keys):
+      logger.warning("sweep: only %d heads; skipping %d", len(keys), num_heads)
+      continue
+    heads = dict([(key, rp[key]) for key in keys[:num_heads]])
+    model = rp[keys[0]].model[:7]
+    for baud in bauds:
+      for acq_speed in speeds:
+        if acq_speed not in rp[keys[0]].acq_speeds[model]:
+          continue
+        for filtercode in filters:
+          result = run_point(heads, filtercode, acq_speed, baud, num_readings)
+          logger.info("sweep: %s", result)
+          results.append(result)
+  return results
+
+def report(results):
+  """
+  Prints the results as a table
+  """
+  print "%5s %6s %6s %4s %10s %8s %8s %8s %8s %9s" % ("heads", "filter",
+        "speed", "baud", "readings/s", "p50 ms", "p90 ms", "p99 ms",
+        "cpu us", "model ms")
+  for r in results:
+    print "%5d %6s %6d %4s %10.1f %8.2f %8.2f %8.2f %8.1f %9.2f" % (r["heads"],
+          r["filter"], r["acq_speed"], r["baud"], r["throughput"], r["p50"],
+          r["p90"], r["p99"], r["cpu"], r["predicted"])
+
+if __name__ == "__main__":
+  p = OptionParser(usage="%prog [options]",
+                   description="Benchmark Radipower acquisition")
+  p.add_option("--emulate", type="int", default=0,
+               help="number of emulated heads; default use hardware")
+  p.add_option("--ports", default=None,
+               help="comma separated serial ports; default /dev/ttyUSB*")
+  p.add_option("--heads", default="1",
+               help="comma separated numbers of heads to read together")
+  p.add_option("--filters", default="1,3,5", help="FILTER codes")
+  p.add_option("--speeds", default="20,100,1000", help="ACQ_SPEEDs in kS/s")
+  p.add_option("--bauds", default=None, help="BAUD codes; default unchanged")
+  p.add_option("--readings", type="int", default=200,
+               help="epochs per sweep point")
+  p.add_option("--output", default=time.strftime("/tmp/RPbench%Y-%j-%H%M.json"),
+               help="JSON results file")
+  opts, args = p.parse_args(sys.argv[1:])
+  logging.basicConfig(level=logging.INFO)
+
+  emulator = None
+  if opts.emulate:
+    from Electronics.Instruments.Radipower.emulator import RadipowerEmulator
+    emulator = RadipowerEmulator(opts.emulate)
+    ports = emulator.ports()
+  elif opts.ports:
+    ports = opts.ports.split(",")
+  else:
+    ports = None
+  rp = find_radipowers(ports=ports)
+  if not rp:
+    logger.error("No power meters found")
+    sys.exit(1)
+  if opts.bauds:
+    bauds = int_list(opts.bauds)
+  else:
+    bauds = [None]
+  try:
+    results = sweep(rp, int_list(opts.heads), int_list(opts.filters),
+                    int_list(opts.speeds), bauds, opts.readings)
+  finally:
+    for head in rp.values():
+      head.close()
+    if emulator:
+      emulator.close()
+  report(results)
+  with open(opts.output, "w") as fd:
+    json.dump({"time": time.time(), "emulated": bool(opts.emulate),
+               "results": results}, fd, indent=2)
+  print "Results written to", opts.output
@@ -1,27 +1,46 @@
 """
-untested program to plot data files in /tmp
+plots radiometer data files in /tmp
+
+Both the older one-head PM* files and the RM* files of the radiometer server
+are read, with module loader, so a file which has been plotted before loads
+from its .npy cache.  Usage::
+  python plot_data.py [glob [decimation]]
 """
 from pylab import *
+import sys
+import time
 
 from support.text import select_files
+from Electronics.Instruments.Radipower.loader import data_files, load
 
 data_path = "/tmp/"
 
-data = {}
 if __name__ == "__main__":
-  files = select_files(data_path+"PM*")
+  if len(sys.argv) > 1:
+    files = data_files(sys.argv[1])
+  else:
+    files = select_files(data_path+"PM*")
+    files = [fname for fname in files if fname in data_files(data_path+"PM*")]
+  decimate = 1
+  if len(sys.argv) > 2:
+    decimate = int(sys.argv[2])
   files.sort()
-  for fname in files:
-    index = files.index(fname)
-    data = loadtxt(fname,dtype=str)
-    startstr = data[0,0]+" "+ data[0,1]
-    start = datestr2num(startstr)
-    
-    tm = datestr2num([ " ".join(line[0:2]) for line in data if len(line) > 1 ])
-    pw = array(data[:,2], dtype=float)
-    plot(tm-start, pw, '.', label=str(index))
-  title(startstr)
+  start = None
+  for index, fname in enumerate(files):
+    keys, tm, pw = load(fname, decimate=decimate)
+    if not len(tm):
+      continue
+    if start == None:
+      start = tm[0]
+    if keys == None:
+      labels = [str(index)]
+    else:
+      labels = ["%d PM%02d" % (index, key) for key in keys]
+    for column, label in enumerate(labels):
+      plot(tm-start, pw[:, column], '.', label=label)
+  if start != None:
+    title(time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(start)))
   legend(numpoints=1)
-  xlabel("elapsed time")
+  xlabel("elapsed time (s)")
   grid()
   show()
@@ -5,8 +5,8 @@ Instead of superceding the inherited loggers it may be possible simply to
 rename them.
 """
 import logging
-import signal
 import sys
+import threading
 import time
 import os
 
@@ -14,7 +14,15 @@ import numpy as np
 import Pyro4
 
 import Electronics.Instruments.Radipower as Radipower
-from Electronics.Instruments.radiometer import Radiometer
+from Electronics.Instruments.Radipower.cache import IdentityCache, PortMap
+from Electronics.Instruments.Radipower.datafile import BinaryWriter, DataWriter
+from Electronics.Instruments.Radipower.history import count_epochs, history
+from Electronics.Instruments.Radipower.readings import ReadingBuffer
+from Electronics.Instruments.Radipower.scheduler import EpochScheduler
+from Electronics.Instruments.Radipower import sharedmem
+from Electronics.Instruments.Radipower.subscriptions import Subscription
+from Electronics.Instruments.Radipower.timing import TimingStore
+from Electronics.Instruments.Radipower.workers import WorkerPool
 import support
 
 from support.pyro import Pyro4Server, config
@@ -26,32 +34,50 @@ class RadiometerServer(Pyro4Server):
     """
     Pyro server for the Radipower radiometer
 
+    The heads are read together by a Radipower.Poller in an acquisition
+    thread and every epoch is kept in a ReadingBuffer.
+
     Public Attributes::
-        datafile - file object to which the data are written
+        buffer   - ReadingBuffer with the recent readings of all heads
+        datafile - datafile.DataWriter writing the data files
         logger   - logging.Logger object
+        pm       - Radipower objects keyed by head index
+        poller   - Radipower.Poller reading all the heads
+        pool     - workers.WorkerPool when the heads are read by workers
+        rate     - number of readings per second
         run      - True when server is running
-    Inherited from Radiometer::
-        integration     - 2*update_interval for Nyquist sampling
-        last_reading    - results of the last power meter reading
-        logger          - logging.Logger object but superceded
-        pm_reader       - DeviceReadThread object
-        reader_done     - threading.Event object, set when reading has been taken
-        reader_started  - threading.Event object, set when a reading is started
-        take_data       - threading.Event object to signal readers to take reading
-        update_interval - inverse of reading rate
-        get_readings    - Get the most recent set of readings from the Radiometer heads.
+        shared   - sharedmem.SharedReadings for local readers, or None
     """
+    file_formats = {"csv": DataWriter, "binary": BinaryWriter}
     help_text = """
     change_rate(rate) - change sampling rate to 'rate' samples per second
+    max_rate()        - estimate the highest rate the heads can deliver
     get_readings()    - return the most recent set of readings
+    get_ave_readings(num) - return averages of the last 'num' readings
+    get_readings_since(seq, max_n) - return epochs from sequence number 'seq'
+    subscribe(callback) - push batches of readings to callback.push()
+    unsubscribe(sub_id) - stop pushing readings to a subscriber
+    get_statistics(seconds) - return mean, min, max and std over a time window
+    get_history(t0, t1, heads, decimate) - return readings from the datafiles
+    get_read_times()  - return measured read times of the heads
+    get_stats()       - return command and error statistics of the heads
+    get_workers()     - return whether each worker process is alive
+    get_datafile()    - return the state of the datafile writer
+    open_datafile(logpath) - start a new datafile in 'logpath'
+    set_verbose(key)  - log every exchange with a head at DEBUG level
+    dump_trace(key)   - save the exchange trace of a head
     stop              - stop the radiometer server
+    Local processes can map the readings with sharedmem.SharedReadingsReader
     """
 
-    def __init__(self, logpath="/var/tmp/", rate=1. / 60, name="Radiometer", logger=None, **kwargs):
+    def __init__(self, logpath="/var/tmp/", rate=1. / 60, name="Radiometer", logger=None,
+                 buffer_size=65536, shm_path=sharedmem.default_path, workers=None,
+                 file_format="csv", compression=None, **kwargs):
         """
         Initialize a Radipower radiometer server
 
-        At present with a Raspberry Pi controller the maximum rate is about 1/s.
+        Epochs are aligned to wall-clock multiples of 1/rate; the highest
+        usable rate is given by max_rate().
 
         Args:
             name (str): name for the Pyro nameserver
@@ -59,17 +85,43 @@ class RadiometerServer(Pyro4Server):
             bus (Pyro4.Proxy): The messagebus proxy.
             logpath (str): directory for the radiometer datafiles
             rate (float): number of readings per second
+            buffer_size (int): number of epochs kept in memory
+            shm_path (str): shared-memory file for local readers, or None
+            workers (str): read the heads in worker processes, one per 'head'
+                or per USB 'bus'; default read them all in this process.
+                With workers, per-head statistics and traces are not
+                available to the server.
+            file_format (str): 'csv' for text datafiles or 'binary' for
+                records which can be mapped with datafile.open_binary()
+            compression (str): block compress the datafiles with 'zlib' or
+                'bz2'; see datafile.BlockFile
         """
         if not logger:
             logger = logging.getLogger(module_logger.name + "." + "RadiometerServer")
         Pyro4Server.__init__(self, name=name, logger=logger, **kwargs)
         self.pm = None
-        self.radiometer = None
-        self.pm_readings = None
-        self.datefile = None
+        self.timing = None
+        self.poller = None
+        self.workers = workers
+        self.pool = None
+        self.buffer = None
+        self.buffer_size = buffer_size
+        self.shm_path = shm_path
+        self.shared = None
+        self.datafile = None
+        if file_format not in self.file_formats:
+            raise ValueError("file_format must be one of %s" %
+                             sorted(self.file_formats.keys()))
+        self.file_format = file_format
+        self.compression = compression
         self.rate = None
         self.logpath = None
         self.run = False
+        self._acquisition = None
+        self.scheduler = None
+        self.subscriptions = {}
+        self._subscription_lock = threading.Lock()
+        self._next_subscription = 0
 
         self.connect_to_hardware(rate, logpath) # this sets some instance attributes
 
@@ -83,77 +135,406 @@ class RadiometerServer(Pyro4Server):
         if support.check_permission('ops') == False:
             raise RuntimeError("Insufficient permission to access USB")
         self.logger.debug("connect_to_hardware: Finding radiometer power meter heads")
-        pm = Radipower.find_radipowers()
-        self.logger.debug("connect_to_hardware: Power meter heads: {}".format(pm))
-        self.pm = pm
+        self.timing = TimingStore()
         self.rate = rate
         self.logpath = logpath
-        self.logger.debug("connect_to_hardware: initializing Radiometer class")
-        self.radiometer = Radiometer(pm, rate=rate)
-        self.pm_readings = None
-        self.open_datafile(logpath)
+        ports = None
+        if self.workers:
+            # the heads are opened by the workers; see workers.WorkerPool
+            ports = dict([(port, Radipower.IDs[ID]) for port, ID
+                          in Radipower.map_ports(PortMap()).items()
+                          if ID in Radipower.IDs])
+            self.pm = {}
+            self.pool = WorkerPool(ports, rate, by=self.workers,
+                                   cache=IdentityCache())
+            keys = self.pool.keys
+        else:
+            pm = Radipower.find_radipowers(portmap=PortMap(),
+                                           cache=IdentityCache(), verify=True,
+                                           timing=self.timing)
+            self.logger.debug("connect_to_hardware: Power meter heads: {}".format(pm))
+            self.pm = pm
+            self.poller = Radipower.Poller(pm)
+            keys = self.poller.keys
+        self.buffer = ReadingBuffer(keys, self.buffer_size)
+        if self.shm_path:
+            self.shared = sharedmem.SharedReadings(keys, path=self.shm_path)
+        self.datafile = self.file_formats[self.file_format](
+            logpath, keys, rate, metadata=self.head_metadata(ports),
+            compression=self.compression)
+        self.scheduler = EpochScheduler(rate)
         self.run = True
-        self.radiometer.start()
+        self._acquisition = threading.Thread(target=self._acquire,
+                                             name="acquisition")
+        self._acquisition.daemon = True
+        self._acquisition.start()
+
+    def _acquire(self):
+        """
+        Reads all the heads once per epoch until the server is stopped
+
+        Every epoch read is written to the datafile first.  A failure in one
+        epoch, including in waiting for it, is logged and the loop goes on,
+        so that the datafile does not silently stop growing.
+        """
+        previous = None
+        while self.run:
+            start = None
+            try:
+                start = self.scheduler.wait()
+                if start is None:
+                    break
+                if self.pool and previous is None:
+                    # the workers are only now taking the first epoch
+                    previous = start
+                    continue
+                if self.pool:
+                    # collect the epoch which the workers have just finished
+                    epoch, previous = previous, start
+                    timestamp, readings = self.pool.read(epoch, start)
+                else:
+                    timestamp, readings = self.poller.read()
+                self.datafile.put(timestamp, readings)
+                seq = self.buffer.append(timestamp, readings)
+                if self.shared:
+                    self.shared.append(timestamp, readings)
+                self._publish(seq, timestamp, readings)
+            except Exception as details:
+                self.logger.exception("_acquire: epoch at %s failed: %s",
+                                      start, details)
 
     def stop(self):
         """
         Stops the radiometer and closes the datafile
         """
-        self.radiometer.close()  # for the Radiometer
+        self.run = False
+        self.scheduler.stop()
+        self._acquisition.join()
+        if self.pool:
+            self.pool.close()
+        for sub_id in self.subscriptions.keys():
+            self.unsubscribe(sub_id)
+        if self.shared:
+            self.shared.close(remove=True)
         self.datafile.close()
+        self.timing.save()
         self.logger.info("close: finished.")
 
+    def head_metadata(self, ports=None):
+        """
+        Describe the heads for the datafile headers
+
+        Args:
+            ports (dict): head index for each port when the heads are read by
+                workers; only the ID_NUMBERs are then known
+        Returns:
+            dict: ID_NUMBER, and model and settings if known, keyed by index
+        """
+        IDs = dict([(index, ID) for ID, index in Radipower.IDs.items()])
+        if ports:
+            return dict([(key, {"ID": IDs[key]}) for key in ports.values()])
+        return dict([(key, {"ID": head.ID, "model": head.model,
+                            "settings": dict(head.settings)})
+                     for key, head in self.pm.items()])
+
     def open_datafile(self, logpath):
         """
-        Opens the datafile
+        Starts a new datafile
 
-        The filename is RMYYY-DDD-HHMM.csv
+        The current file is finished in the background and the next epoch
+        starts RMYYYY-DDD-HHMMSS.csv (or .rpd) in 'logpath'; see module
+        datafile.
 
         @param logpath : directory for the radiometer datafiles
         @type  logpath : str
         """
-        filename = time.strftime("RM%Y-%j-%H%M.csv", time.gmtime(time.time()))
-        self.datafile = open(os.path.join(logpath, filename), "w")
+        self.logpath = logpath
+        self.datafile.rotate(directory=logpath)
+
+    def get_datafile(self):
+        """
+        Get the state of the datafile writer
+
+        Returns:
+            dict: current file and counts of epochs written and dropped
+        """
+        return self.datafile.status()
 
     def change_rate(self, rate):
         """
         Change the reading rate
 
-        Closes the datafile, sets the new rate and open a new datafile.
+        The acquisition thread uses the new rate from the next epoch on and
+        readers are not disturbed.  The datafile is rotated in the background
+        so that each file has a single rate.  Epochs are aligned to
+        multiples of 1/rate s of wall-clock time.  If the heads cannot keep
+        up, epochs are skipped; see get_read_times() and max_rate().
         """
-        # ? suspend the read threads
-        # pause the timer
-        signal.setitimer(signal.ITIMER_REAL, 0)
-        # close the data file
-        logpath = os.path.dirname(self.datafile.name)
-        self.datafile.close()
-        # set the new rate
-        self.radiometer.set_rate(rate)
-        # open a new data file
-        self.open_datafile(logpath + "/")
-        # ? resume the read threads
-        # resume the timer
-        support.sync_second()
-        signal.setitimer(signal.ITIMER_REAL, self.radiometer.update_interval, self.radiometer.update_interval)
+        if rate > self.max_rate():
+            self.logger.warning("change_rate: %s/s is above the %.2f/s the "
+                                "heads can deliver", rate, self.max_rate())
+        self.scheduler.set_rate(rate)
+        self.datafile.rotate(rate=rate)
+        if self.pool:
+            self.pool.set_rate(rate)
+        self.rate = rate
+
+    def max_rate(self):
+        """
+        Estimate the highest rate at which all the heads can be read
+
+        The heads are read concurrently, so the slowest head sets the limit.
+        The measured 90th percentile read time is used when there is one,
+        otherwise the vendor's model.  The measured times come from the
+        acquisition loop: the Poller times the head whose reply it reads
+        first, a different head each epoch, so each head has a measurement
+        after some ten epochs per head.  With worker processes the heads are
+        not visible to the server and the result is infinite; with no heads
+        it is 0.
+
+        Returns:
+            float: epochs per second
+        """
+        if self.pool:
+            return float("inf")
+        if not self.pm:
+            return 0.
+        slowest = 0.
+        for head in self.pm.values():
+            read_time = head.read_time(p=90)
+            if read_time is None:
+                read_time = head.calc_read_speed()
+            slowest = max(slowest, read_time)
+        return 1. / slowest
 
     def get_readings(self):
         """
         Get radiometer power meter readings
+
+        Returns:
+            dict: the most recent reading of each head keyed by head index
         """
-        readings = self.radiometer.get_readings()
-        return readings
+        latest = self.buffer.latest()
+        if latest is None:
+            return {}
+        timestamp, readings = latest
+        return dict(zip(self.buffer.keys, readings.tolist()))
 
     def get_ave_readings(self, num=1):
         """
-        Get a number of readings, and average them.
+        Average the last 'num' readings of each head.
+
+        Args:
+            num (int): the number of readings to average.
+        Returns:
+            list: averages in the order of the head indices
+        """
+        return self.buffer.statistics(num=num)["mean"].tolist()
+
+    def get_readings_since(self, seq=0, max_n=10000):
+        """
+        Get all the epochs from sequence number 'seq' on, in columns
+
+        A client passes the 'next' value of one batch as 'seq' for the next
+        to get every epoch exactly once.  'lost' counts epochs which were
+        overwritten in the buffer before they were fetched.  'session'
+        changes when the server is restarted and the sequence numbers start
+        again; a 'seq' beyond the last epoch gets the oldest epochs kept.
+
+        Args:
+            seq (int): sequence number of the first epoch wanted
+            max_n (int): largest number of epochs returned
+        Returns:
+            dict: 'keys', 'session', 'first', 'next', 'lost', 'time' (list
+                of epoch times) and 'power' (one list of readings per head,
+                in the order of 'keys')
+        """
+        first, times, power = self.buffer.since(seq, max_n)
+        return {"keys": self.buffer.keys,
+                "session": self.buffer.session,
+                "first": first,
+                "next": first + len(times),
+                "lost": max(first - seq, 0),
+                "time": times.tolist(),
+                "power": power.T.tolist()}
+
+    def get_history(self, t0, t1, heads=None, decimate=1, max_n=100000):
+        """
+        Get the readings between two times from the datafiles
+
+        Only the parts of the datafiles holding the time range are read; see
+        module history.  If the catalog shows that there would be more than
+        'max_n' epochs the decimation is increased, and the files are
+        decimated as they are read, so only what is returned is held.
+
+        Args:
+            t0 (float): start time in seconds since the epoch
+            t1 (float): stop time
+            heads (list): head indices wanted; default all
+            decimate (int): return one epoch in this many
+            max_n (int): largest number of epochs returned
+        Returns:
+            dict: 'keys', 'decimate', 'time' and 'power' (one list of
+                readings per head, in the order of 'keys')
+        """
+        estimate = count_epochs(self.datafile.directory, t0, t1,
+                                rate=self.rate)
+        decimate = max(int(decimate), -(-estimate // max_n), 1)
+        keys, times, power = history(self.datafile.directory, t0, t1,
+                                     keys=heads, decimate=decimate,
+                                     writer=self.datafile, max_n=max_n)
+        return {"keys": keys,
+                "decimate": decimate,
+                "time": times.tolist(),
+                "power": power.T.tolist()}
+
+    def subscribe(self, callback, decimate=1, batch_size=10, batch_interval=1.):
+        """
+        Have batches of readings pushed to a callback
+
+        Each subscriber has its own queue and thread.  A subscriber which
+        cannot keep up is decimated further and eventually dropped; it
+        never slows down acquisition.  See subscriptions.Subscription.
+
+        Args:
+            callback (Pyro4.Proxy): object with a 'push(batch)' method
+            decimate (int): deliver one epoch in this many
+            batch_size (int): epochs per batch
+            batch_interval (float): longest wait in seconds for a full batch
+        Returns:
+            int: subscription ID for unsubscribe()
+        """
+        with self._subscription_lock:
+            sub_id = self._next_subscription
+            self._next_subscription += 1
+            self.subscriptions[sub_id] = Subscription(
+                callback, self.buffer.keys, decimate=decimate,
+                batch_size=batch_size, batch_interval=batch_interval,
+                name=str(sub_id))
+        self.logger.info("subscribe: subscription %d", sub_id)
+        return sub_id
+
+    def unsubscribe(self, sub_id):
+        """
+        Stop pushing readings to a subscriber
+
+        Args:
+            sub_id (int): ID returned by subscribe()
+        """
+        with self._subscription_lock:
+            subscription = self.subscriptions.pop(sub_id, None)
+        if subscription:
+            subscription.close()
+
+    def get_subscriptions(self):
+        """
+        Get the state of every subscription
+
+        Returns:
+            dict: decimation and delivery counters keyed by subscription ID
+        """
+        return dict([(sub_id, sub.status())
+                     for sub_id, sub in self.subscriptions.items()])
+
+    def _publish(self, seq, timestamp, readings):
+        """
+        Offer one epoch to the subscribers, forgetting dropped ones
+        """
+        if not self.subscriptions:
+            return
+        with self._subscription_lock:
+            for sub_id, subscription in self.subscriptions.items():
+                if subscription.dropped:
+                    self.logger.warning("_publish: subscription %d dropped", sub_id)
+                    del self.subscriptions[sub_id]
+                else:
+                    subscription.offer(seq, timestamp, readings)
+
+    def get_statistics(self, seconds=None, num=None):
+        """
+        Get statistics of the readings in a recent time window
+
+        Args:
+            seconds (float): length of the window; default the whole buffer
+            num (int): alternatively, the number of epochs
+        Returns:
+            dict: 'keys', 'count', 'start', 'stop' and lists of 'mean', 'min',
+                'max' and 'std' in the order of 'keys'
+        """
+        stats = self.buffer.statistics(seconds, num)
+        result = {"keys": self.buffer.keys}
+        for name, value in stats.items():
+            if isinstance(value, np.ndarray):
+                value = value.tolist()
+            result[name] = value
+        return result
+
+    def get_read_times(self):
+        """
+        Get the measured POWER? round trip times of the heads
+
+        Returns:
+            dict: for each head, count, mean and p50/p90/p99 in seconds keyed
+                by 'FILTER/ACQ_SPEED/BAUD'
+        """
+        return dict([(key, self.pm[key].timing.summary())
+                     for key in self.pm.keys() if self.pm[key].timing])
+
+    def get_stats(self, reset=False):
+        """
+        Get command counts, latencies and error counts of the heads
+
+        See Radipower.stats() for the contents.
+
+        Args:
+            reset (bool): clear the counters after reading them
+        Returns:
+            dict: statistics keyed by head index
+        """
+        return dict([(key, self.pm[key].stats(reset)) for key in self.pm.keys()])
+
+    def get_workers(self):
+        """
+        Get the state of the worker processes
+
+        Returns:
+            dict: True for each worker which is alive, keyed by name; empty
+                if the heads are read by the server itself
+        """
+        if self.pool:
+            return self.pool.status()
+        return {}
+
+    def set_verbose(self, key, verbose=True):
+        """
+        Turn DEBUG logging of every exchange with one head on or off
+
+        Args:
+            key (int): head index
+            verbose (bool): log exchanges if True
+        """
+        self.pm[key].set_verbose(verbose)
+
+    def dump_trace(self, key):
+        """
+        Save the exchange trace of one head in 'traces' in the log directory
+
+        The traces are kept apart from the datafiles, and their names do not
+        start with 'PM' like the older data files, so that nothing which
+        looks for data files picks them up.
+
         Args:
-            num (int): the number of readings to get.
+            key (int): head index
         Returns:
-            dict
+            str: name of the .npy file written
         """
-        readings = [[self.radiometer.get_readings()[j] for j in xrange(8)] for i in xrange(num)]
-        readings = np.mean(readings, axis=0)
-        return readings.tolist()
+        directory = os.path.join(self.logpath, "traces")
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        filename = os.path.join(directory, "trace-PM%02d-%s.npy" % (key,
+                                time.strftime("%Y-%j-%H%M%S", time.gmtime())))
+        self.pm[key].dump_trace(filename)
+        return filename
 
     def help(self):
         return RadiometerServer.help_text
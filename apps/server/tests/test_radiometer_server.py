@@ -68,6 +68,29 @@ class TestRadiometerServer(unittest.TestCase):
         logger.debug(readings)
         self.assertTrue(isinstance(readings, list))
 
+    def test_get_statistics(self):
+        client = self.__class__.client
+        stats = client.get_statistics(num=5)
+        self.assertTrue(stats["count"] <= 5)
+        self.assertEqual(len(stats["mean"]), len(stats["keys"]))
+
+    def test_get_readings_since(self):
+        client = self.__class__.client
+        batch = client.get_readings_since(0, 100)
+        self.assertEqual(batch["next"] - batch["first"], len(batch["time"]))
+        self.assertEqual(len(batch["power"]), len(batch["keys"]))
+        again = client.get_readings_since(batch["next"] + 10**9, 100)
+        self.assertEqual(again["session"], batch["session"])
+        self.assertTrue(again["first"] <= batch["next"])
+
+    def test_get_stats(self):
+        client = self.__class__.client
+        stats = client.get_stats()
+        self.assertTrue(isinstance(stats, dict))
+        for head_stats in stats.values():
+            self.assertTrue("verbs" in head_stats)
+            self.assertTrue("errors" in head_stats)
+
     def test_get_help(self):
         client = self.__class__.client
         help_text = client.help()
@@ -81,6 +104,9 @@ if __name__ == "__main__":
 
     suite_get.addTest(TestRadiometerServer("test_get_readings"))
     suite_get.addTest(TestRadiometerServer("test_get_ave_readings"))
+    suite_get.addTest(TestRadiometerServer("test_get_statistics"))
+    suite_get.addTest(TestRadiometerServer("test_get_readings_since"))
+    suite_get.addTest(TestRadiometerServer("test_get_stats"))
     suite_get.addTest(TestRadiometerServer("test_get_help"))
 
     suite_set.addTest(TestRadiometerServer("test_stop"))
@@ -0,0 +1,159 @@
+"""
+On-disk caches of Radipower identities and port assignments
+
+The model, hardware and software versions and the frequency range of a head
+never change for a given ID_NUMBER, so they need to be asked for only once.
+The identity cache is a JSON file keyed by the ID_NUMBER (the keys of module
+variable 'IDs')::
+  {"1.99.234.24.23.0.0.212": {"model": "RPR2006C", "HWversion": "...",
+                              "SWversion": "...", "f_min": 0.01,
+                              "f_max": 6.0}, ...}
+
+The port map is a JSON file which remembers which head was found behind
+which USB serial adapter, keyed as described in module 'sysfs'::
+  {"serial:FT1ABCDE": {"ID": "1.99.234.24.23.0.0.212", "vendor": "0403",
+                       "product": "6001"}, ...}
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+cache_dir = os.path.expanduser("~/.Radipower")
+
+class JSONCache(object):
+  """
+  Dict of dicts kept in a JSON file
+
+  Public attributes::
+    entries - dict of dicts
+    logger  - logging.Logger object
+    path    - name of the cache file
+  """
+  def __init__(self, path):
+    """
+    @param path : name of the cache file; created when first saved
+    @type  path : str
+    """
+    self.logger = logging.getLogger(logger.name+"."+self.__class__.__name__)
+    self.path = path
+    self._lock = threading.Lock()
+    self.entries = {}
+    self.load()
+
+  def load(self):
+    """
+    Reads the cache file, if there is one
+    """
+    try:
+      fd = open(self.path)
+    except IOError:
+      self.logger.debug("load: no cache file %s", self.path)
+      return
+    try:
+      entries = json.load(fd)
+    except ValueError, details:
+      self.logger.warning("load: ignoring corrupt %s: %s", self.path, details)
+      entries = {}
+    fd.close()
+    with self._lock:
+      self.entries = entries
+
+  def save(self):
+    """
+    Writes the cache file
+
+    The file is replaced atomically so a reader never sees a partial file.
+    """
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.exists(directory):
+      os.makedirs(directory)
+    with self._lock:
+      fd, tmpname = tempfile.mkstemp(dir=directory or ".", suffix=".tmp")
+      with os.fdopen(fd, "w") as tmpfile:
+        json.dump(self.entries, tmpfile, indent=2, sort_keys=True)
+      os.rename(tmpname, self.path)
+
+  def put(self, key, save=True, **values):
+    """
+    Stores values for a key
+    """
+    with self._lock:
+      self.entries.setdefault(key, {}).update(values)
+    if save:
+      self.save()
+
+  def invalidate(self, key=None):
+    """
+    Forgets one key or, if no key is given, everything
+    """
+    with self._lock:
+      if key == None:
+        self.entries = {}
+      else:
+        self.entries.pop(key, None)
+    self.save()
+
+
+class IdentityCache(JSONCache):
+  """
+  Persistent cache of static head properties keyed by ID_NUMBER
+
+  Public attributes::
+    fields - names of the cached Radipower attributes
+  """
+  fields = ("model", "HWversion", "SWversion", "f_min", "f_max")
+
+  def __init__(self, path=os.path.join(cache_dir, "identity.json")):
+    """
+    @param path : name of the cache file; created when first saved
+    @type  path : str
+    """
+    super(IdentityCache, self).__init__(path)
+
+  def get(self, ID):
+    """
+    Returns the cached properties for a head or None
+    """
+    with self._lock:
+      entry = self.entries.get(ID)
+    if entry and all(field in entry for field in self.fields):
+      return dict(entry)
+    return None
+
+
+class PortMap(JSONCache):
+  """
+  Learned mapping of USB serial adapters to head ID_NUMBERs
+  """
+  def __init__(self, path=os.path.join(cache_dir, "ports.json")):
+    """
+    @param path : name of the map file; created when first saved
+    @type  path : str
+    """
+    super(PortMap, self).__init__(path)
+
+  def get(self, key, usb):
+    """
+    Returns the ID_NUMBER learned for an adapter or None
+
+    None is also returned if the adapter behind a topology key has changed.
+
+    @param key : adapter key from sysfs.port_key()
+    @type  key : str
+
+    @param usb : adapter properties from sysfs.usb_ports()
+    @type  usb : dict
+    """
+    with self._lock:
+      entry = self.entries.get(key)
+    if not entry:
+      return None
+    if entry.get("vendor") != usb.get("vendor") or \
+       entry.get("product") != usb.get("product"):
+      self.logger.info("get: adapter at %s has changed", key)
+      return None
+    return entry["ID"]
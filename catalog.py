@@ -0,0 +1,56 @@
+"""
+Catalog of the radiometer data files in a directory
+
+Every data file finished by a datafile.DataWriter is entered, by file name,
+in 'catalog.json' in its directory, so the files covering a time range can
+be found without opening any of them::
+  {"RM2016-124-120000.csv": {"start": 1462276800.0, "stop": 1462280399.0,
+                             "epochs": 3600, "keys": [0, 1, ...],
+                             "rate": 1.0, "format": "csv",
+                             "compression": null}, ...}
+'start' and 'stop' are the times of the first and last epoch.  The rows of
+a file are found with its sidecar index; see module history.
+"""
+import logging
+import os
+
+from Electronics.Instruments.Radipower.cache import JSONCache
+
+logger = logging.getLogger(__name__)
+
+class Catalog(JSONCache):
+  """
+  Data files in one directory keyed by file name
+
+  Public attributes::
+    directory - where the data files are
+  """
+  def __init__(self, directory):
+    """
+    @param directory : where the data files and 'catalog.json' are
+    @type  directory : str
+    """
+    self.directory = directory
+    super(Catalog, self).__init__(os.path.join(directory, "catalog.json"))
+
+  def select(self, start=None, stop=None):
+    """
+    Returns the entries of the files with epochs between 'start' and 'stop'
+
+    @return: list of (full file name, entry), oldest first
+    """
+    with self._lock:
+      entries = self.entries.items()
+    selected = [(entry["start"], name, entry) for name, entry in entries
+                if (start == None or entry["stop"] >= start) and
+                   (stop == None or entry["start"] <= stop)]
+    return [(os.path.join(self.directory, name), entry)
+            for first, name, entry in sorted(selected)]
+
+  def files(self, start=None, stop=None):
+    """
+    Returns the files with epochs between 'start' and 'stop', oldest first
+
+    @return: list of full file names
+    """
+    return [name for name, entry in self.select(start, stop)]
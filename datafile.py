@@ -0,0 +1,606 @@
+"""
+Radiometer data files written in the background
+
+A DataWriter takes epochs from the acquisition loop through a bounded queue
+and writes them from its own thread in batches, so the loop never waits for
+the disk; on an SD card a single write can take hundreds of ms.  If the
+queue is full the epoch is counted as dropped rather than waited for.
+
+A file is started when the first epoch after a rotation arrives and is named
+after that epoch, RMYYYY-DDD-HHMMSS.csv in UTC.  Until it is finished it is
+written as <name>.part, and it is renamed to its final name when it is
+complete, so anything which picks up finished files never sees a partial
+one.  Files are rotated after 'max_seconds', after 'max_bytes', on a rate
+change, and on request.
+
+The CSV files look like::
+  # Radipower radiometer
+  # rate: 1.0 epochs/s
+  date,time,PM00,PM01,...
+  2016-05-03,12:00:00.013,-35.112,-40.567,...
+with times in UTC and readings in dBm; a head which did not answer has 'nan'.
+
+A BinaryWriter writes the same epochs as fixed-size records which numpy can
+map directly, RMYYYY-DDD-HHMMSS.rpd::
+  magic        - 8 bytes, 'RPDATA01'
+  header size  - uint32, little-endian
+  header       - JSON, padded with spaces to a multiple of 8 bytes
+  records      - float64 time and float32 reading per head, little-endian
+The JSON header has 'keys', the record 'dtype', the 'rate' and 'heads', with
+the ID_NUMBER, model and settings of each head keyed by head index.  Records
+are only ever appended, so the number of records is given by the file size;
+see open_binary().
+
+Either format can be block compressed with a codec from the standard
+library, adding '.blk' to the name.  Batches are held until they add up to
+'block_size' bytes, or the oldest has been held for 'block_interval'
+seconds, and are then compressed together as one block, so that the blocks
+do not follow the flush cadence but no epoch stays only in memory for long;
+the last block of a file is written when the file is finished.  A reader can inflate just the blocks
+covering a time range::
+  magic   - 8 bytes, 'RPBLOCK1', then the codec name padded to 8 bytes
+  blocks  - a frame (compressed size, raw size, epochs, first and last
+            epoch time) and the compressed data; block 0 holds the header
+            of the format inside
+  index   - when the file is finished, the frames and their offsets as an
+            array of 'index_type', followed by its offset and 'RPINDEX1'
+A file without an index, e.g. one still being written, is indexed by
+walking the frames.  See BlockFile.
+
+When a file is finished its index, in the same form as that of a block
+compressed file, is also written next to it as <name>.idx (a .npy file),
+and the file is entered in the catalog of its directory; see modules
+catalog and history.
+"""
+import bz2
+import json
+import logging
+import os
+import Queue
+import struct
+import threading
+import time
+import zlib
+from StringIO import StringIO
+
+from numpy import array, dtype, empty, frombuffer, memmap, nan, save
+
+from Electronics.Instruments.Radipower.catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+magic = "RPDATA01"
+block_magic = "RPBLOCK1"
+index_magic = "RPINDEX1"
+# compressed size, raw size, number of epochs, first and last epoch time
+frame = struct.Struct("<IIIdd")
+trailer = struct.Struct("<Q8s")
+index_type = dtype([("offset", "<u8"), ("size", "<u4"), ("raw", "<u4"),
+                    ("count", "<u4"), ("start", "<f8"), ("stop", "<f8")])
+codecs = {"bz2": (bz2.compress, bz2.decompress),
+          "zlib": (zlib.compress, zlib.decompress)}
+
+class DataWriter(object):
+  """
+  Background writer of radiometer data files
+
+  Public attributes::
+    block_interval - longest time epochs are held for a compressed block
+    block_size  - uncompressed size at which a compressed block is written
+    compression - block compression codec or None
+    directory   - where the files are written
+    dropped     - number of epochs lost because the queue was full
+    errors      - number of batches lost to I/O errors
+    filename    - final name of the file being written, or None
+    keys        - head indices in the order of the readings
+    lock        - held while the file is written, finished or renamed
+    logger      - logging.Logger object
+    metadata    - head descriptions for the file header
+    rate        - epochs per second, recorded in the file header
+    written     - number of epochs written to the file
+  """
+  extension = ".csv"
+  format_name = "csv"
+
+  def __init__(self, directory, keys, rate, max_seconds=3600.,
+               max_bytes=64*2**20, batch_size=256, flush_interval=10.,
+               max_queue=65536, metadata=None, compression=None,
+               block_size=2**16, block_interval=300.):
+    """
+    @param directory : where the files are written
+    @type  directory : str
+
+    @param keys : head indices in the order of the readings
+    @type  keys : list of int
+
+    @param rate : epochs per second
+    @type  rate : float
+
+    @param max_seconds : start a new file after this many seconds
+    @type  max_seconds : float
+
+    @param max_bytes : start a new file when one reaches this size
+    @type  max_bytes : int
+
+    @param batch_size : write when this many epochs are waiting
+    @type  batch_size : int
+
+    @param flush_interval : or when the oldest has waited this many seconds
+    @type  flush_interval : float
+
+    @param max_queue : epochs waiting before new ones are dropped
+    @type  max_queue : int
+
+    @param metadata : ID_NUMBER, model and settings keyed by head index
+    @type  metadata : dict of dict
+
+    @param compression : codec for block compression, e.g. 'zlib', or None
+    @type  compression : str
+
+    @param block_size : uncompressed size at which a block is written
+    @type  block_size : int
+
+    @param block_interval : or the seconds after which a block is written
+    @type  block_interval : float
+    """
+    if compression and not codecs.has_key(compression):
+      raise ValueError("compression must be one of %s" % sorted(codecs.keys()))
+    self.logger = logging.getLogger(logger.name+"."+self.__class__.__name__)
+    self.directory = directory
+    self.keys = list(keys)
+    self.rate = rate
+    self.metadata = metadata or {}
+    self.compression = compression
+    self.block_size = block_size
+    self.block_interval = block_interval
+    self.max_seconds = max_seconds
+    self.max_bytes = max_bytes
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.dropped = 0
+    self.errors = 0
+    self.written = 0
+    self.filename = None
+    self.lock = threading.RLock()
+    self._file = None
+    self._opened = None
+    self._size = 0
+    self._pending = []
+    self._pending_size = 0
+    self._pending_since = None
+    self._queue = Queue.Queue(max_queue)
+    self._thread = threading.Thread(target=self._run, name="datafile")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def put(self, timestamp, readings):
+    """
+    Queues one epoch; never blocks
+
+    @param timestamp : epoch time
+    @type  timestamp : float
+
+    @param readings : one reading per head in the order of 'keys'
+    @type  readings : sequence of float
+    """
+    try:
+      self._queue.put_nowait(("epoch", (timestamp, readings)))
+    except Queue.Full:
+      self.dropped += 1
+
+  def rotate(self, rate=None, directory=None):
+    """
+    Finishes the current file after the epochs already queued
+
+    The next epoch starts a new file, with the new rate in its header and
+    in the new directory if given.
+    """
+    self._queue.put(("rotate", (rate, directory)))
+
+  def close(self):
+    """
+    Writes everything queued, finishes the file and stops the thread
+    """
+    self._queue.put(("close", None))
+    self._thread.join()
+
+  def status(self):
+    """
+    Returns the counters as a dict
+    """
+    return {"file": self.filename, "queued": self._queue.qsize(),
+            "written": self.written, "dropped": self.dropped,
+            "errors": self.errors}
+
+  def _run(self):
+    """
+    Writes batches and rotates files until closed
+    """
+    batch = []
+    started = time.time()
+    while True:
+      try:
+        kind, payload = self._queue.get(timeout=self.flush_interval)
+      except Queue.Empty:
+        kind, payload = "flush", None
+      if kind == "epoch":
+        if not batch:
+          started = time.time()
+        batch.append(payload)
+        if len(batch) < self.batch_size and \
+           time.time()-started < self.flush_interval:
+          continue
+      if batch:
+        self._write(batch)
+        batch = []
+      elif kind == "flush" and self._pending:
+        self._write_due()
+      if kind == "rotate":
+        rate, directory = payload
+        self._finish()
+        if rate != None:
+          self.rate = rate
+        if directory != None:
+          self.directory = directory
+      elif kind == "close":
+        self._finish()
+        return
+      elif self._file and (self._size >= self.max_bytes or
+                           time.time()-self._opened >= self.max_seconds):
+        self._finish()
+
+  def _open(self, timestamp):
+    """
+    Starts a file named after the time of its first epoch
+    """
+    name = time.strftime("RM%Y-%j-%H%M%S", time.gmtime(timestamp))
+    self.filename = os.path.join(self.directory, name+self.extension)
+    if self.compression:
+      self.filename += ".blk"
+    if not os.path.exists(self.directory):
+      os.makedirs(self.directory)
+    self._file = open(self.filename+".part", "wb")
+    self._opened = time.time()
+    self._size = 0
+    self._index = []
+    self._pending = []
+    self._pending_size = 0
+    if self.compression:
+      self._file.write(block_magic + self.compression.ljust(8))
+      self._size = 16
+    self._append(self._header(), 0, nan, nan)
+    self.logger.debug("_open: %s", self.filename)
+
+  def _append(self, data, count, start, stop):
+    """
+    Writes data, or when compressing holds it until there is a whole block
+
+    @param count : number of epochs in the data
+    @param start : time of the first epoch
+    @param stop : time of the last epoch
+    """
+    if not self.compression or not count:
+      self._write_block(data, count, start, stop)
+      return
+    if not self._pending:
+      self._pending_since = time.time()
+    self._pending.append((data, count, start, stop))
+    self._pending_size += len(data)
+    if self._block_due():
+      self._flush_block()
+
+  def _block_due(self):
+    """
+    True if the data held for a compressed block should be written now
+    """
+    return bool(self._pending) and \
+           (self._pending_size >= self.block_size or
+            time.time()-self._pending_since >= self.block_interval)
+
+  def _write_due(self):
+    """
+    Writes the held data as a block if it has waited long enough
+    """
+    try:
+      with self.lock:
+        if self._file and self._block_due():
+          self._flush_block()
+          self._file.flush()
+    except (IOError, OSError), details:
+      self.errors += 1
+      self.logger.error("_write_due: %s", details)
+
+  def _flush_block(self):
+    """
+    Writes the data held by _append() as one compressed block
+    """
+    if not self._pending:
+      return
+    pending = self._pending
+    self._pending = []
+    self._pending_size = 0
+    self._write_block("".join([data for data, count, start, stop in pending]),
+                      sum([count for data, count, start, stop in pending]),
+                      pending[0][2], pending[-1][3])
+
+  def _write_block(self, data, count, start, stop):
+    """
+    Writes data, as a compressed block if compressing, and indexes it
+    """
+    if self.compression:
+      packed = codecs[self.compression][0](data)
+      self._index.append((self._size, len(packed), len(data), count,
+                          start, stop))
+      data = frame.pack(len(packed), len(data), count, start, stop) + packed
+    else:
+      self._index.append((self._size, len(data), len(data), count,
+                          start, stop))
+    self._file.write(data)
+    self._size += len(data)
+    self.written += count
+
+  def _write(self, batch):
+    """
+    Writes a batch of (timestamp, readings) and flushes the file
+    """
+    try:
+      with self.lock:
+        if not self._file:
+          self._open(batch[0][0])
+        self._append(self._format(batch), len(batch), batch[0][0],
+                     batch[-1][0])
+        self._file.flush()
+    except (IOError, OSError), details:
+      self.errors += 1
+      self.logger.error("_write: lost %d epochs: %s", len(batch), details)
+
+  def _finish(self):
+    """
+    Closes the current file, gives it its final name and catalogs it
+    """
+    with self.lock:
+      self._close_file()
+
+  def _close_file(self):
+    """
+    Does the work of _finish() with the lock held
+    """
+    if not self._file:
+      return
+    try:
+      self._flush_block()
+      index = array(self._index, index_type)
+      if self.compression:
+        self._file.write(index.tostring() +
+                         trailer.pack(self._size, index_magic))
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self._file.close()
+      with open(self.filename+".idx.part", "wb") as fd:
+        save(fd, index)
+      os.rename(self.filename+".idx.part", self.filename+".idx")
+      os.rename(self._file.name, self.filename)
+      epochs = index[index["count"] > 0]
+      if len(epochs):
+        Catalog(self.directory).put(os.path.basename(self.filename),
+                                    start=epochs["start"][0],
+                                    stop=epochs["stop"][-1],
+                                    epochs=int(epochs["count"].sum()),
+                                    keys=self.keys, rate=self.rate,
+                                    format=self.format_name,
+                                    compression=self.compression)
+    except (IOError, OSError), details:
+      self.errors += 1
+      self.logger.error("_finish: %s: %s", self.filename, details)
+    self.logger.debug("_finish: %s", self.filename)
+    self._file = None
+    self.filename = None
+
+  def _header(self):
+    """
+    Returns the text at the start of a file
+    """
+    return "# Radipower radiometer\n# rate: %s epochs/s\ndate,time,%s\n" % (
+           self.rate, ",".join(["PM%02d" % key for key in self.keys]))
+
+  def _format(self, batch):
+    """
+    Returns the text of a batch of epochs
+    """
+    lines = []
+    for timestamp, readings in batch:
+      when = time.strftime("%Y-%m-%d,%H:%M:%S", time.gmtime(timestamp))
+      lines.append("%s.%03d,%s\n" % (when, int(timestamp % 1 * 1000),
+                   ",".join(["%.3f" % reading for reading in readings])))
+    return "".join(lines)
+
+
+class BinaryWriter(DataWriter):
+  """
+  Background writer of binary radiometer data files
+
+  Public attributes, in addition to those of DataWriter::
+    dtype - numpy record type of one epoch
+  """
+  extension = ".rpd"
+  format_name = "binary"
+
+  def __init__(self, directory, keys, rate, **kwargs):
+    """
+    See DataWriter for the arguments.
+    """
+    self.dtype = record_type(len(keys))
+    super(BinaryWriter, self).__init__(directory, keys, rate, **kwargs)
+
+  def _header(self):
+    """
+    Returns the magic number, header size and JSON header
+    """
+    header = json.dumps({"keys": self.keys, "rate": self.rate,
+                         "dtype": self.dtype.descr,
+                         "heads": dict([(str(key), value) for key, value
+                                        in self.metadata.items()])})
+    header += " "*(-(len(magic)+4+len(header)) % 8)
+    return magic + struct.pack("<I", len(header)) + header
+
+  def _format(self, batch):
+    """
+    Returns the records of a batch of epochs
+    """
+    records = empty(len(batch), self.dtype)
+    for index, (timestamp, readings) in enumerate(batch):
+      records[index] = (timestamp, readings)
+    return records.tostring()
+
+
+def record_type(num_heads):
+  """
+  Returns the numpy record type of an epoch in a binary file
+  """
+  return dtype([("time", "<f8"), ("power", "<f4", (num_heads,))])
+
+def open_binary(filename, mode="r"):
+  """
+  Maps the records of a binary data file
+
+  A record being appended while the file is opened is left out.
+
+  @param filename : name of a .rpd file, finished or .part
+  @type  filename : str
+
+  @return: (header dict, record array with fields 'time' and 'power')
+  """
+  with open(filename, "rb") as fd:
+    header, offset = parse_header(fd.read(len(magic)+4), fd, filename)
+  records = record_type(len(header["keys"]))
+  count = (os.path.getsize(filename)-offset) // records.itemsize
+  if not count:
+    return header, empty(0, records)
+  return header, memmap(filename, records, mode, offset, (count,))
+
+def parse_header(start, fd, filename):
+  """
+  Reads the JSON header of a binary data file
+
+  @param start : the first 12 bytes of the file
+  @param fd : file positioned after them
+
+  @return: (header dict, offset of the first record)
+  """
+  if start[:len(magic)] != magic:
+    raise ValueError("%s is not a binary radiometer file" % filename)
+  size, = struct.unpack("<I", start[len(magic):])
+  return json.loads(fd.read(size)), len(start)+size
+
+
+class BlockFile(object):
+  """
+  Reader of a block compressed data file
+
+  Public attributes::
+    codec    - name of the compression codec
+    filename - name of the file
+    index    - array of 'index_type', one row per block; block 0 is the
+               header of the format inside
+  """
+  def __init__(self, filename):
+    """
+    @param filename : name of a .blk file, finished or .part
+    @type  filename : str
+    """
+    self.filename = filename
+    with open(filename, "rb") as fd:
+      if fd.read(len(block_magic)) != block_magic:
+        raise ValueError("%s is not a block compressed file" % filename)
+      self.codec = fd.read(8).strip()
+      if not codecs.has_key(self.codec):
+        raise ValueError("%s has unknown codec %s" % (filename, self.codec))
+      self.index = self._read_index(fd)
+      if self.index is None:
+        self.index = self._scan(fd)
+
+  def _read_index(self, fd):
+    """
+    Returns the index at the end of a finished file or None
+    """
+    fd.seek(0, os.SEEK_END)
+    size = fd.tell()
+    if size < 16+trailer.size:
+      return None
+    fd.seek(size-trailer.size)
+    offset, tag = trailer.unpack(fd.read(trailer.size))
+    if tag != index_magic or offset > size-trailer.size:
+      return None
+    fd.seek(offset)
+    return frombuffer(fd.read(size-trailer.size-offset), index_type)
+
+  def _scan(self, fd):
+    """
+    Indexes the blocks by walking the frames; an incomplete block is ignored
+    """
+    fd.seek(0, os.SEEK_END)
+    size = fd.tell()
+    offset = 16
+    entries = []
+    while offset+frame.size <= size:
+      fd.seek(offset)
+      packed, raw, count, start, stop = frame.unpack(fd.read(frame.size))
+      if offset+frame.size+packed > size:
+        break
+      entries.append((offset, packed, raw, count, start, stop))
+      offset += frame.size+packed
+    return array(entries, index_type)
+
+  def block(self, number):
+    """
+    Returns the inflated data of a block
+    """
+    offset = int(self.index["offset"][number])
+    packed = int(self.index["size"][number])
+    with open(self.filename, "rb") as fd:
+      fd.seek(offset+frame.size)
+      return codecs[self.codec][1](fd.read(packed))
+
+  def header(self):
+    """
+    Returns the header of the format inside
+    """
+    return self.block(0)
+
+  def read(self, start=None, stop=None):
+    """
+    Returns the inflated data of the blocks with epochs from 'start' to 'stop'
+
+    Whole blocks are returned, so there may be epochs just outside the range.
+    """
+    # block 0, the header, has no epoch times, so leave it out first
+    numbers = (self.index["count"] > 0).nonzero()[0]
+    if start != None:
+      numbers = numbers[self.index["stop"][numbers] >= start]
+    if stop != None:
+      numbers = numbers[self.index["start"][numbers] <= stop]
+    return "".join([self.block(number) for number in numbers])
+
+
+def load_records(filename, start=None, stop=None):
+  """
+  Returns the records of a binary data file in a time range
+
+  Block compressed files are read with BlockFile, inflating only the blocks
+  needed, and others are mapped with open_binary().
+
+  @return: (header dict, record array with fields 'time' and 'power')
+  """
+  if filename.endswith(".blk") or filename.endswith(".blk.part"):
+    blocks = BlockFile(filename)
+    inner = blocks.header()
+    header, offset = parse_header(inner[:len(magic)+4],
+                                  StringIO(inner[len(magic)+4:]), filename)
+    records = frombuffer(blocks.read(start, stop),
+                         record_type(len(header["keys"])))
+  else:
+    header, records = open_binary(filename)
+  times = records["time"]
+  first = 0 if start == None else times.searchsorted(start)
+  last = len(times) if stop == None else times.searchsorted(stop, "right")
+  return header, records[first:last]
@@ -0,0 +1,239 @@
+"""
+Radipower emulator on pseudo-terminals
+
+Each EmulatedHead opens a pseudo-terminal and answers the commands used by
+class Radipower on it, so that find_radipowers() and everything built on it
+can be run and benchmarked without hardware::
+  >>> emulator = RadipowerEmulator(16)
+  >>> rp = find_radipowers(ports=emulator.ports())
+  ...
+  >>> emulator.close()
+
+A POWER? reply is delayed by the time the head would take to average the
+samples selected by FILTER at the ACQ_SPEED sampling rate (see the module
+docstring of Radipower) plus the time to transfer the command and reply at
+the BAUD rate and a fixed link latency.
+"""
+import logging
+import os
+import pty
+import random
+import select
+import threading
+import tty
+from time import sleep
+
+from Electronics.Instruments.Radipower import IDs, parse_frequency, Radipower, \
+                                              RadipowerError
+
+logger = logging.getLogger(__name__)
+
+class EmulatedHead(object):
+  """
+  One emulated Radipower behind a pseudo-terminal
+
+  Public attributes::
+    ID       - ID_NUMBER
+    latency  - fixed USB/link latency per reply in s
+    logger   - logging.Logger object
+    model    - e.g. 'RPR2006C'
+    noise    - rms of the readings for one sample in dB
+    port     - name of the pseudo-terminal to open
+    power    - mean reading in dBm
+    settings - current FILTER, ACQ_SPEED, BAUD, VBW, POWER_UNIT and FREQUENCY
+               (in Hz)
+  """
+  def __init__(self, ID, model="RPR2006C", power=-35., noise=0.5,
+               latency=0.001):
+    """
+    @param ID : ID_NUMBER returned by the head
+    @type  ID : str
+
+    @param model : model returned by *IDN?
+    @type  model : str
+
+    @param power : mean reading in dBm
+    @type  power : float
+
+    @param noise : rms of a one-sample reading in dB
+    @type  noise : float
+
+    @param latency : fixed delay for each reply in s
+    @type  latency : float
+    """
+    self.ID = ID
+    self.model = model
+    self.power = power
+    self.noise = noise
+    self.latency = latency
+    self.logger = logging.getLogger(logger.name+".EmulatedHead")
+    self.settings = {"FILTER": "AUTO", "ACQ_SPEED": "1000", "BAUD": "1",
+                     "VBW": "AUTO", "POWER_UNIT": "0",
+                     "FREQUENCY": "1300000000"}
+    self._master, self._slave = pty.openpty()
+    tty.setraw(self._slave)
+    self.port = os.ttyname(self._slave)
+    self._run = True
+    self._thread = threading.Thread(target=self._serve, name="emulator-"+ID)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def close(self):
+    """
+    Stops answering and closes the pseudo-terminal
+    """
+    self._run = False
+    self._thread.join()
+    os.close(self._master)
+    os.close(self._slave)
+
+  def _serve(self):
+    """
+    Reads commands and writes replies until closed
+    """
+    received = ""
+    while self._run:
+      ready, w, x = select.select([self._master], [], [], 0.1)
+      if not ready:
+        continue
+      received += os.read(self._master, 1024)
+      while "\n" in received:
+        line, received = received.split("\n", 1)
+        reply = self.respond(line.strip())
+        os.write(self._master, reply+"\n")
+
+  def samples(self):
+    """
+    Number of samples averaged for the current FILTER setting
+    """
+    family = self.model[:7]
+    if self.settings["FILTER"] == "AUTO":
+      # same power level bands as Radipower.get_samples_averaged()
+      if self.power > -20.:
+        code = 3
+      elif self.power > -30.:
+        code = 4
+      elif self.power > -40.:
+        code = 5
+      elif self.power > -50.:
+        code = 6
+      else:
+        code = 7
+    else:
+      code = int(self.settings["FILTER"])
+    return Radipower.filtercodes[family][code]
+
+  def reading_time(self):
+    """
+    Time in s for one POWER? round trip with the current settings
+    """
+    acq_speed = int(self.settings["ACQ_SPEED"])
+    baud = int(self.settings["BAUD"])
+    return Radipower.predict_read_time(self.samples(), acq_speed, baud) + \
+           self.latency
+
+  def reading(self):
+    """
+    A reading in dBm with noise reduced by averaging
+    """
+    return random.gauss(self.power, self.noise/self.samples()**0.5)
+
+  def respond(self, command):
+    """
+    Returns the reply to one command
+    """
+    family = self.model[:7]
+    verb, sep, argument = command.partition(" ")
+    verb = verb.upper()
+    argument = argument.strip().upper()
+    error = "ERROR %d;[" + command + "]"
+    if verb == "POWER?":
+      sleep(self.reading_time())
+      return "%.2f dBm" % self.reading()
+    sleep(self.latency)
+    if verb == "ID_NUMBER?":
+      return self.ID
+    elif verb == "*IDN?":
+      return "DARE!! Instruments,%s,%s" % (self.model, self.ID)
+    elif verb == "VERSION_HW?":
+      return "1.0"
+    elif verb == "VERSION_SW?":
+      return "2.7"
+    elif verb == "TEMPERATURE?":
+      return "253"
+    elif verb == "FREQUENCY?" and argument == "MIN":
+      return "10000 kHz"
+    elif verb == "FREQUENCY?" and argument == "MAX":
+      return "6000000 kHz"
+    elif verb == "FREQUENCY?":
+      return "%d kHz" % (int(self.settings["FREQUENCY"])//1000)
+    elif verb[-1:] == "?" and self.settings.has_key(verb[:-1]):
+      if family == "RPR1018" and verb == "ACQ_SPEED?":
+        return error % 1
+      return self.settings[verb[:-1]]
+    elif verb == "FILTER":
+      codes = [str(code) for code in Radipower.filtercodes[family]]
+      if argument != "AUTO" and argument not in codes:
+        return error % 50
+      self.settings[verb] = argument
+    elif verb == "ACQ_SPEED":
+      if family == "RPR1018":
+        return error % 1
+      if not argument.isdigit():
+        return error % 50
+      if int(argument) not in Radipower.acq_speeds[family]:
+        return error % 51
+      self.settings[verb] = argument
+    elif verb == "BAUD":
+      if argument not in ("0", "1", "2", "3"):
+        return error % 50
+      self.settings[verb] = argument
+    elif verb == "FREQUENCY":
+      try:
+        self.settings[verb] = str(int(round(parse_frequency(argument)*1e9)))
+      except (RadipowerError, ValueError):
+        return error % 50
+    elif verb in ("VBW", "POWER_UNIT"):
+      self.settings[verb] = argument.split(" ")[0]
+    else:
+      return error % 1
+    return "OK"
+
+
+class RadipowerEmulator(object):
+  """
+  A rack of emulated heads
+
+  The heads get the ID_NUMBERs of the real heads in module variable 'IDs',
+  in the order of their indices, so find_radipowers() sees familiar keys.
+
+  Public attributes::
+    heads - EmulatedHead objects
+  """
+  def __init__(self, num_heads=16, model="RPR2006C", **kwargs):
+    """
+    @param num_heads : number of heads
+    @type  num_heads : int
+
+    @param model : model of all the heads
+
+    Other keyword arguments are passed to EmulatedHead.
+    """
+    known = sorted(IDs.keys(), key=lambda ID: IDs[ID])
+    if num_heads > len(known):
+      raise ValueError("at most %d heads can be emulated" % len(known))
+    self.heads = [EmulatedHead(ID, model=model, **kwargs)
+                  for ID in known[:num_heads]]
+
+  def ports(self):
+    """
+    Names of the pseudo-terminals
+    """
+    return [head.port for head in self.heads]
+
+  def close(self):
+    """
+    Stops all the heads
+    """
+    for head in self.heads:
+      head.close()
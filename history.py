@@ -0,0 +1,215 @@
+"""
+Readings from the data files between two times
+
+The files overlapping the time range are found in the directory's catalog
+(module catalog), and only the parts of them holding the range are read:
+binary files are mapped and searched, block compressed files inflate only
+the blocks needed, and CSV files are read from the byte offsets in their
+sidecar index.  A file without a sidecar, e.g. the one being written, is
+read whole, with the lock of its writer held so that it is not written to
+or renamed meanwhile.
+"""
+import calendar
+import logging
+import math
+import time
+
+from numpy import array, concatenate, empty, load, nan
+
+from Electronics.Instruments.Radipower.catalog import Catalog
+from Electronics.Instruments.Radipower.datafile import BlockFile, load_records
+
+logger = logging.getLogger(__name__)
+
+def csv_keys(header):
+  """
+  Returns the head indices from the column names of a CSV file header
+  """
+  for line in header.splitlines():
+    if line.startswith("date,time,"):
+      return [int(name[2:]) for name in line.split(",")[2:]]
+  raise ValueError("no column names in CSV header")
+
+def parse_csv(text, num_heads):
+  """
+  Converts the data lines of a CSV file to arrays
+
+  Comment and column name lines and an incomplete last line are skipped.
+
+  @return: (times, power with one row per epoch)
+  """
+  times = []
+  power = []
+  lines = text.split("\n")
+  for line in lines[:-1]: # the last is empty or incomplete
+    if not line or line[0] == "#" or line.startswith("date,"):
+      continue
+    date, clock, values = line.split(",", 2)
+    times.append(calendar.timegm(time.strptime(date+" "+clock[:8],
+                                               "%Y-%m-%d %H:%M:%S")) +
+                 float(clock[8:] or 0))
+    power.append([float(value) for value in values.split(",")])
+  if not times:
+    return empty(0), empty((0, num_heads))
+  return array(times), array(power)
+
+def _read_csv(filename, start, stop):
+  """
+  Returns keys, times and power from a plain CSV file
+  """
+  with open(filename, "rb") as fd:
+    try:
+      index = load(filename+".idx")
+    except IOError:
+      text = fd.read()
+      keys = csv_keys(text[:text.find("\n", text.find("date,"))+1])
+      times, power = parse_csv(text, len(keys))
+      return keys, times, power
+    keys = csv_keys(fd.read(int(index["size"][0])))
+    # the header entry has no epoch times, so leave it out before comparing
+    blocks = index[index["count"] > 0]
+    if start != None:
+      blocks = blocks[blocks["stop"] >= start]
+    if stop != None:
+      blocks = blocks[blocks["start"] <= stop]
+    if not len(blocks):
+      return keys, empty(0), empty((0, len(keys)))
+    # the blocks are contiguous, so read from the first to the last
+    fd.seek(int(blocks["offset"][0]))
+    text = fd.read(int(blocks["offset"][-1]+blocks["size"][-1]-
+                       blocks["offset"][0]))
+  times, power = parse_csv(text, len(keys))
+  return keys, times, power
+
+def read_range(filename, start=None, stop=None):
+  """
+  Returns the epochs of one data file from 'start' to 'stop'
+
+  @param filename : data file in any format, finished or .part
+  @type  filename : str
+
+  @return: (keys, times, power with one row per epoch)
+  """
+  name = filename
+  if name.endswith(".part"):
+    name = name[:-len(".part")]
+  if name.endswith(".rpd") or name.endswith(".rpd.blk"):
+    header, records = load_records(filename, start, stop)
+    return header["keys"], records["time"], records["power"]
+  if name.endswith(".blk"):
+    blocks = BlockFile(filename)
+    keys = csv_keys(blocks.header())
+    times, power = parse_csv(blocks.read(start, stop), len(keys))
+  else:
+    keys, times, power = _read_csv(filename, start, stop)
+  if len(times):
+    selected = (times >= (start if start != None else times[0])) & \
+               (times <= (stop if stop != None else times[-1]))
+    times, power = times[selected], power[selected]
+  return keys, times, power
+
+def _read(filename, start, stop):
+  """
+  Returns what read_range() does, or None if the file cannot be read
+  """
+  try:
+    return read_range(filename, start, stop)
+  except (IOError, ValueError), details:
+    logger.error("history: cannot read %s: %s", filename, details)
+    return None
+
+def count_epochs(directory, start=None, stop=None, rate=None):
+  """
+  Estimates from the catalog the number of epochs from 'start' to 'stop'
+
+  The epochs of a file are taken to be spread evenly over it.  The file
+  being written is not cataloged; its epochs are counted only if 'rate'
+  is given, as those at that rate from the last cataloged epoch to now.
+
+  @param rate : epochs per second of the file being written
+  @type  rate : float
+  """
+  catalog = Catalog(directory)
+  total = 0.
+  for filename, entry in catalog.select(start, stop):
+    span = entry["stop"]-entry["start"]
+    first = max(entry["start"], start if start != None else entry["start"])
+    last = min(entry["stop"], stop if stop != None else entry["stop"])
+    total += entry["epochs"]*((last-first)/span if span > 0 else 1.)
+  if rate:
+    now = time.time()
+    first = max([entry["stop"] for filename, entry in catalog.select()] or
+                [start or now])
+    if start != None:
+      first = max(first, start)
+    last = now if stop == None else min(stop, now)
+    total += max(last-first, 0.)*rate
+  return int(math.ceil(total))
+
+def history(directory, start, stop, keys=None, decimate=1, writer=None,
+            max_n=None):
+  """
+  Returns the epochs from 'start' to 'stop' in the files of a directory
+
+  Heads which are not in a file get NaN for its epochs.
+
+  @param directory : where the data files and their catalog are
+  @type  directory : str
+
+  @param keys : head indices wanted; default those of the first file
+  @type  keys : list of int
+
+  @param decimate : return one epoch in this many
+  @type  decimate : int
+
+  @param writer : writer of the file being written, which is not yet
+                  cataloged
+  @type  writer : datafile.DataWriter
+
+  @param max_n : stop reading files once this many epochs are kept
+  @type  max_n : int
+
+  @return: (keys, times, power with one row per epoch)
+  """
+  filenames = Catalog(directory).files(start, stop)
+  if writer:
+    filenames.append(None) # the writer's current file
+  all_times = []
+  all_power = []
+  kept = 0
+  skip = 0 # epochs to skip at the start of the next file
+  for filename in filenames:
+    if max_n != None and kept >= max_n:
+      break
+    if filename == None:
+      with writer.lock:
+        if not writer.filename:
+          continue
+        result = _read(writer.filename+".part", start, stop)
+    else:
+      result = _read(filename, start, stop)
+    if result == None:
+      continue
+    file_keys, times, power = result
+    # decimate file by file, in step across files, so that only what is
+    # kept is held
+    length = len(times)
+    times, power = times[skip::decimate], power[skip::decimate]
+    skip = (skip-length) % decimate
+    if keys == None:
+      keys = list(file_keys)
+    columns = empty((len(times), len(keys)))
+    columns.fill(nan)
+    for column, key in enumerate(keys):
+      if key in file_keys:
+        columns[:, column] = power[:, list(file_keys).index(key)]
+    all_times.append(times)
+    all_power.append(columns)
+    kept += len(times)
+  if keys == None:
+    keys = []
+  if not all_times:
+    return keys, empty(0), empty((0, len(keys)))
+  times = concatenate(all_times)[:max_n]
+  power = concatenate(all_power)[:max_n]
+  return keys, times, power
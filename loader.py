@@ -0,0 +1,191 @@
+"""
+Fast loading of radiometer data files
+
+Two kinds of text file are read::
+  RM*.csv - written by datafile.DataWriter; comma separated with '#' comment
+            lines and a 'date,time,PM00,...' line naming the heads
+  PM*     - older files of one head; 'date time reading' separated by
+            white space, dates with '-' or '/'
+The lines are read in chunks of 'chunk_lines' and each chunk is converted
+at once: the date and time columns are joined and parsed by numpy as
+datetime64 and the readings are converted as one array, instead of parsing
+every line in Python.  iter_chunks() yields the chunks one at a time so that
+files larger than memory can be reduced as they are read.
+
+load() keeps what it has parsed as <name>.npy next to the file, a record
+array with a 'time' field and one field per head named as in the file
+header, so loading the file again is just a memory map.  The cache is used
+only while it is newer than the file.  Binary and block compressed files
+are read with module history, which is already fast.
+"""
+import logging
+import os
+import tempfile
+from glob import glob
+from itertools import islice
+
+from numpy import array, char, concatenate, dtype, empty, load as load_npy, \
+                  save
+
+from Electronics.Instruments.Radipower.history import csv_keys, read_range
+
+logger = logging.getLogger(__name__)
+
+cache_extension = ".npy"
+# files next to the data files which are not data files
+not_data = (cache_extension, ".idx", ".part", ".tmp", ".verbs",
+            "catalog.json")
+
+def data_files(pattern):
+  """
+  Returns the data files matching a glob, leaving out caches and indices
+  """
+  return sorted([name for name in glob(pattern)
+                 if not name.endswith(not_data)])
+
+def _header(fd):
+  """
+  Reads the comment and column name lines of a CSV file
+
+  @return: (head keys or None if the file has no column names, separator)
+  """
+  keys = None
+  separator = None
+  while True:
+    position = fd.tell()
+    line = fd.readline()
+    if line.startswith("#"):
+      continue
+    if line.startswith("date,time,"):
+      keys = csv_keys(line)
+      separator = ","
+      continue
+    fd.seek(position)
+    return keys, separator
+
+def _convert(lines, separator, columns):
+  """
+  Converts a chunk of data lines to epoch times and readings
+
+  Lines with the wrong number of columns and an incomplete last line are
+  left out.
+  """
+  fields = [line.rstrip().split(separator) for line in lines
+            if line.endswith("\n")]
+  fields = array([row for row in fields if len(row) == columns])
+  if not len(fields):
+    return empty(0), empty((0, columns-2))
+  dates = char.replace(fields[:, 0], "/", "-")
+  stamps = char.add(char.add(dates, "T"), fields[:, 1])
+  times = stamps.astype("datetime64[us]").astype("int64")/1e6
+  return times, fields[:, 2:].astype(float)
+
+def iter_chunks(filename, chunk_lines=100000):
+  """
+  Yields (keys, times, readings) for successive chunks of a text data file
+
+  'keys' is None for a PM* file.  'readings' has one row per epoch.
+  """
+  with open(filename, "rb") as fd:
+    keys, separator = _header(fd)
+    columns = None
+    while True:
+      lines = list(islice(fd, chunk_lines))
+      if not lines:
+        return
+      if columns == None:
+        columns = len(lines[0].rstrip().split(separator))
+      times, readings = _convert(lines, separator, columns)
+      yield keys, times, readings
+
+def _cache_type(names):
+  """
+  Returns the record type of a cache with columns 'names'
+  """
+  return dtype([("time", "<f8")] + [(name, "<f4") for name in names])
+
+def _names(keys, num_columns):
+  """
+  Returns the cache field names of the reading columns
+  """
+  if keys == None:
+    return ["power%d" % column for column in range(num_columns)]
+  return ["PM%02d" % key for key in keys]
+
+def _from_cache(records):
+  """
+  Returns keys, times and readings from a cache record array
+  """
+  names = records.dtype.names[1:]
+  if names and names[0].startswith("PM"):
+    keys = [int(name[2:]) for name in names]
+  else:
+    keys = None
+  readings = empty((len(records), len(names)))
+  for column, name in enumerate(names):
+    readings[:, column] = records[name]
+  return keys, records["time"], readings
+
+def _save_cache(filename, keys, times, readings):
+  """
+  Writes the cache file atomically; failure only costs speed next time
+  """
+  records = empty(len(times), _cache_type(_names(keys, readings.shape[1])))
+  records["time"] = times
+  for column, name in enumerate(records.dtype.names[1:]):
+    records[name] = readings[:, column]
+  directory = os.path.dirname(filename) or "."
+  try:
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmpfile:
+      save(tmpfile, records)
+    os.rename(tmpname, filename+cache_extension)
+  except (IOError, OSError), details:
+    logger.warning("_save_cache: cannot cache %s: %s", filename, details)
+
+def load(filename, chunk_lines=100000, decimate=1, cache=True):
+  """
+  Returns the epochs of a data file
+
+  @param filename : RM* or PM* data file in any format
+  @type  filename : str
+
+  @param chunk_lines : lines converted at a time
+  @type  chunk_lines : int
+
+  @param decimate : keep one epoch in this many, as the file is read
+  @type  decimate : int
+
+  @param cache : use and write <filename>.npy
+  @type  cache : bool
+
+  @return: (keys or None for a PM* file, times, readings with one row per
+           epoch)
+  """
+  name = filename[:-len(".part")] if filename.endswith(".part") else filename
+  if name.endswith(".rpd") or name.endswith(".blk"):
+    keys, times, readings = read_range(filename)
+    return keys, times[::decimate], readings[::decimate]
+  cached = filename+cache_extension
+  if cache and os.path.exists(cached) and \
+     os.path.getmtime(cached) >= os.path.getmtime(filename):
+    keys, times, readings = _from_cache(load_npy(cached, mmap_mode="r"))
+    return keys, times[::decimate], readings[::decimate]
+  keys = None
+  all_times = []
+  all_readings = []
+  skip = 0 # epochs to skip at the start of the next chunk
+  for keys, times, readings in iter_chunks(filename, chunk_lines):
+    if decimate > 1:
+      length = len(times)
+      times, readings = times[skip::decimate], readings[skip::decimate]
+      skip = (skip-length) % decimate
+    all_times.append(times)
+    all_readings.append(readings)
+  if not all_times:
+    return keys, empty(0), empty((0, len(keys or [])))
+  times = concatenate(all_times)
+  readings = concatenate(all_readings)
+  if cache and decimate == 1 and filename == name:
+    _save_cache(filename, keys, times, readings)
+  return keys, times, readings
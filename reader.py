@@ -0,0 +1,114 @@
+"""
+Line reader for Radipower serial ports
+
+pyserial's readline() reads one byte at a time and builds a new string for
+every reply.  LineReader instead pulls whatever bytes are waiting into one
+reusable bytearray and finds the line ends in place, so the cost per reply
+stays small when the heads are polled at a high rate.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+CR = ord("\r")
+LF = ord("\n")
+SPACE = ord(" ")
+UNITS = b"dBm"
+
+class LineReader(object):
+  """
+  Reads newline terminated replies from a serial port
+
+  Public attributes::
+    buffer - bytearray holding received bytes
+    port   - serial.Serial object with readinto()
+  """
+  def __init__(self, port, size=4096):
+    """
+    @param port : open serial port
+    @type  port : serial.Serial
+
+    @param size : buffer size in bytes; longer lines are split
+    @type  size : int
+    """
+    self.port = port
+    self.buffer = bytearray(size)
+    self._view = memoryview(self.buffer)
+    self._start = 0 # first unread byte
+    self._end = 0   # end of received bytes
+    self._line = (0, 0)
+
+  def _fill(self):
+    """
+    Reads the bytes waiting, or waits for one, and returns the number read
+    """
+    if self._start == self._end:
+      self._start = self._end = 0
+    elif self._end == len(self.buffer):
+      # move the partial line to the front
+      size = self._end-self._start
+      self.buffer[:size] = self._view[self._start:self._end].tobytes()
+      self._start, self._end = 0, size
+    space = len(self.buffer)-self._end
+    if space == 0:
+      return 0
+    count = min(max(1, self.port.inWaiting()), space)
+    received = self.port.readinto(self._view[self._end:self._end+count])
+    self._end += received
+    return received
+
+  def _next_line(self):
+    """
+    Finds the next line and returns its (start, stop) in the buffer
+
+    The line terminator and trailing blanks are not included.  On a time-out
+    the partial line, possibly empty, is returned.
+    """
+    while True:
+      index = self.buffer.find(b"\n", self._start, self._end)
+      if index >= 0:
+        start, self._start = self._start, index+1
+        break
+      if not self._fill():
+        start, index = self._start, self._end
+        self._start = self._end
+        break
+    while index > start and self.buffer[index-1] in (CR, LF, SPACE):
+      index -= 1
+    self._line = (start, index)
+    return start, index
+
+  def readline(self):
+    """
+    Returns the next line as a string without its terminator
+    """
+    start, stop = self._next_line()
+    return self.last_line()
+
+  def last_line(self):
+    """
+    Returns the line most recently read as a string
+    """
+    start, stop = self._line
+    return str(self.buffer[start:stop]).strip()
+
+  def read_power(self):
+    """
+    Returns the next reply as a reading in dBm or None
+
+    The ' dBm' suffix is skipped in the buffer.  None is returned for a reply
+    which is not a reading; it can be fetched with last_line().
+    """
+    start, stop = self._next_line()
+    if self.buffer.endswith(UNITS, start, stop):
+      stop -= len(UNITS)
+    try:
+      return float(self.buffer[start:stop])
+    except ValueError:
+      return None
+
+  def reset(self):
+    """
+    Discards any received bytes
+    """
+    self._start = self._end = 0
@@ -0,0 +1,162 @@
+"""
+In-memory store of radiometer readings
+
+A ReadingBuffer holds the most recent readings of all the heads in
+preallocated numpy arrays used as a ring, so that memory use is constant and
+averages or other statistics over a time window are computed on real samples
+with vectorized operations.
+"""
+import logging
+import threading
+import uuid
+
+from numpy import arange, empty, errstate, isnan, nan, nanmax, nanmean, \
+                  nanmin, nanstd
+
+logger = logging.getLogger(__name__)
+
+class ReadingBuffer(object):
+  """
+  Ring buffer of timestamped readings of all heads
+
+  Each epoch has a sequence number, its position in the order of appending
+  starting at 0, so a client can ask for everything it has not yet seen.
+  The numbers start again in a new buffer, e.g. after a server restart, so
+  each buffer has its own 'session' for a client to notice that.
+
+  Public attributes::
+    capacity - number of epochs kept
+    count    - number of epochs appended since creation, i.e. the sequence
+               number of the next epoch
+    keys     - head indices in the order of the power columns
+    power    - readings in dBm, one row per epoch
+    session  - identifier of this buffer, different in every one
+    times    - epoch times in s since the epoch
+  """
+  def __init__(self, keys, capacity=65536):
+    """
+    @param keys : head indices, e.g. Poller.keys
+    @type  keys : list of int
+
+    @param capacity : number of epochs kept
+    @type  capacity : int
+    """
+    self.logger = logging.getLogger(logger.name+".ReadingBuffer")
+    self.keys = list(keys)
+    self.capacity = capacity
+    self.times = empty(capacity)
+    self.power = empty((capacity, len(self.keys)))
+    self.count = 0
+    self.session = uuid.uuid4().hex
+    self._lock = threading.Lock()
+
+  def append(self, timestamp, readings):
+    """
+    Stores the readings of one epoch, overwriting the oldest if full
+
+    @param timestamp : epoch time
+    @type  timestamp : float
+
+    @param readings : one reading per head in the order of 'keys'
+    @type  readings : sequence of float
+
+    @return: sequence number of the epoch
+    """
+    with self._lock:
+      index = self.count % self.capacity
+      self.times[index] = timestamp
+      self.power[index] = readings
+      self.count += 1
+      return self.count-1
+
+  def _last(self, num):
+    """
+    Returns copies of the last 'num' epochs, oldest first
+
+    The lock must be held.
+    """
+    num = min(num, self.count, self.capacity)
+    end = self.count % self.capacity
+    start = end-num
+    if start >= 0:
+      return self.times[start:end].copy(), self.power[start:end].copy()
+    index = range(start, end) # negative indices wrap around
+    return self.times[index], self.power[index]
+
+  def latest(self):
+    """
+    Returns the time and readings of the last epoch, or None
+    """
+    with self._lock:
+      if not self.count:
+        return None
+      index = (self.count-1) % self.capacity
+      return self.times[index], self.power[index].copy()
+
+  def since(self, seq, max_n=None):
+    """
+    Returns the epochs with sequence numbers from 'seq' on
+
+    Epochs which have already been overwritten are skipped, so the first
+    epoch returned may be later than 'seq'.  A 'seq' beyond 'count' was
+    given by an earlier buffer, so the epochs are returned from the oldest
+    kept.
+
+    @param seq : sequence number of the first epoch wanted
+    @type  seq : int
+
+    @param max_n : largest number of epochs returned
+    @type  max_n : int
+
+    @return: (sequence number of the first epoch returned, times, power)
+    """
+    with self._lock:
+      if seq > self.count:
+        seq = 0
+      first = max(seq, self.count-self.capacity, 0)
+      last = self.count
+      if max_n != None:
+        last = min(last, first+max_n)
+      index = arange(first, last) % self.capacity
+      return first, self.times[index], self.power[index]
+
+  def window(self, seconds=None, num=None):
+    """
+    Returns the epochs in the last 'seconds' or the last 'num' epochs
+
+    With neither, everything in the buffer is returned.
+
+    @return: (times, power) arrays, oldest first
+    """
+    with self._lock:
+      if num == None:
+        num = self.capacity
+      times, power = self._last(num)
+    if seconds != None and len(times):
+      first = times.searchsorted(times[-1]-seconds, side="right")
+      times, power = times[first:], power[first:]
+    return times, power
+
+  def statistics(self, seconds=None, num=None):
+    """
+    Returns mean, minimum, maximum and standard deviation of each head
+
+    NaN readings, from heads which did not answer, are left out.  See
+    window() for the arguments.
+
+    @return: dict with arrays in the order of 'keys'
+    """
+    times, power = self.window(seconds, num)
+    result = {"count": len(times), "start": None, "stop": None}
+    if len(times):
+      result.update(start=times[0], stop=times[-1])
+    # heads with no readings in the window get NaN without a warning
+    answered = ~isnan(power).all(axis=0)
+    for name, function in (("mean", nanmean), ("min", nanmin),
+                           ("max", nanmax), ("std", nanstd)):
+      result[name] = empty(len(self.keys))
+      result[name].fill(nan)
+      if answered.any():
+        with errstate(invalid="ignore"):
+          result[name][answered] = function(power[:, answered], axis=0)
+    return result
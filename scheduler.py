@@ -0,0 +1,132 @@
+"""
+Drift-free epoch scheduling
+
+Acquisition used to sleep for whatever was left of the period after each
+epoch, so every late wake-up and every slow epoch pushed all later epochs
+back.  EpochScheduler instead computes each epoch start from its index,
+epoch n starting at wall-clock time n/rate, so that errors never
+accumulate and epochs line up with whole seconds (or minutes) in the data
+files.  It waits on the monotonic clock, which is not affected by NTP
+steps; the offset to the wall clock is measured again for every epoch so
+slewing is followed.
+
+An epoch which cannot start on time because the previous one overran is
+skipped, not delayed, so a rate above what the heads can deliver degrades
+to the fastest rate they can manage on the same grid.
+
+The rate may be changed from another thread while wait() is running; the
+schedule is only touched with the scheduler's lock held.
+"""
+import ctypes
+import ctypes.util
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+  from time import monotonic
+except ImportError:
+  # Python 2 has no monotonic clock; ask the C library for one
+  class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+  CLOCK_MONOTONIC = 1 # linux/time.h
+  try:
+    _clock_gettime = ctypes.CDLL(ctypes.util.find_library("rt") or
+                                 ctypes.util.find_library("c"),
+                                 use_errno=True).clock_gettime
+  except (OSError, AttributeError):
+    logger.warning("no clock_gettime; epochs will follow clock steps")
+    monotonic = time.time
+  else:
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+      """
+      Returns the CLOCK_MONOTONIC time in s
+      """
+      now = _timespec()
+      if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+      return now.tv_sec + now.tv_nsec*1e-9
+
+class EpochScheduler(object):
+  """
+  Wakes up at the start of each epoch on a wall-clock aligned grid
+
+  Public attributes::
+    logger  - logging.Logger object
+    missed  - number of epochs skipped because the caller was late
+    rate    - epochs per second
+    running - False after stop()
+  """
+  max_nap = 0.1 # s; longest sleep between checks for stop() or set_rate()
+
+  def __init__(self, rate):
+    """
+    @param rate : epochs per second
+    @type  rate : float
+    """
+    self.logger = logging.getLogger(logger.name+".EpochScheduler")
+    self.running = True
+    self.missed = 0
+    self._next = None
+    self._lock = threading.Lock() # guards 'rate' and '_next'
+    self.set_rate(rate)
+
+  def set_rate(self, rate):
+    """
+    Changes the rate from the next epoch on
+
+    The epoch being waited for, if any, is rescheduled on the new grid.
+    """
+    if rate <= 0:
+      raise ValueError("rate must be positive, not %s" % rate)
+    with self._lock:
+      self.rate = float(rate)
+      self._next = None
+
+  def stop(self):
+    """
+    Makes wait() return None
+    """
+    self.running = False
+
+  def _epoch(self, wall_time):
+    """
+    Returns the index of the first epoch starting after 'wall_time'
+    """
+    return int(math.floor(wall_time*self.rate)) + 1
+
+  def wait(self):
+    """
+    Sleeps until the next epoch starts
+
+    @return: nominal wall-clock start of the epoch or None if stopped
+    """
+    while self.running:
+      with self._lock:
+        rate = self.rate
+        offset = time.time() - monotonic()
+        if self._next == None:
+          self._next = self._epoch(monotonic()+offset)
+        start = self._next/rate
+        now = monotonic()+offset
+        if now >= start + 1./rate:
+          # overran; resume on the grid
+          skipped = self._epoch(now) - self._next
+          self.missed += skipped
+          self.logger.debug("wait: late by %.3f s; skipped %d epochs",
+                            now-start, skipped)
+          self._next += skipped
+          continue
+        if now >= start:
+          self._next += 1
+          return start
+      time.sleep(min(start-now, self.max_nap))
+    return None
@@ -0,0 +1,245 @@
+"""
+Shared-memory export of radiometer readings
+
+The server writes every epoch into a memory-mapped file, normally on
+/dev/shm, so that processes on the same controller can read the readings
+without Pyro4.  The file has a fixed layout::
+  header - magic, layout version, number of heads, capacity, count
+  keys   - int32 head indices in the order of the power columns
+  times  - float64 epoch times, a ring of 'capacity' epochs
+  power  - float64 readings in dBm, 'capacity' rows of one per head
+
+Only the server writes.  It stores an epoch in slot count % capacity and
+then increments 'count', so 'count' works as the sequence of a seqlock:
+a reader notes which epochs it wants, copies them, and then reads 'count'
+again.  Any epoch older than count+1-capacity may have been overwritten
+during the copy and is discarded.  Readers never block the writer and
+never take a lock.
+
+A restarted server replaces the file, so readers should open it again
+(see SharedReadingsReader.stale()).
+"""
+import logging
+import os
+import tempfile
+
+from numpy import arange, array, dtype, float64, frombuffer, int32, memmap, \
+                  ndarray, zeros
+
+logger = logging.getLogger(__name__)
+
+default_path = "/dev/shm/radiometer"
+magic = "RPSHM"
+version = 1
+
+header_type = dtype([("magic", "S8"), ("version", "<u4"),
+                     ("num_heads", "<u4"), ("capacity", "<u8"),
+                     ("count", "<u8")])
+header_size = 64 # leaves room for more header fields
+
+def layout(num_heads, capacity):
+  """
+  Returns the byte offsets of keys, times and power and the file size
+  """
+  keys = header_size
+  times = keys + 8*((4*num_heads+7)//8) # keep float64 aligned
+  power = times + 8*capacity
+  return keys, times, power, power + 8*capacity*num_heads
+
+class _SharedBuffer(object):
+  """
+  Arrays mapped onto a shared readings file
+
+  Public attributes::
+    capacity - number of epochs kept
+    keys     - head indices in the order of the power columns
+    logger   - logging.Logger object
+    path     - name of the file
+    power    - readings, one row per epoch; a view of the file
+    times    - epoch times; a view of the file
+  """
+  def _attach(self, mode):
+    """
+    Checks the header and size of the file, then maps it and creates the
+    array views
+
+    A file which is not a shared readings file of this layout version, or
+    is shorter than its header says, raises ValueError.
+    """
+    with open(self.path, "r+b" if mode == "r+" else "rb") as fd:
+      status = os.fstat(fd.fileno())
+      start = fd.read(header_size)
+      if len(start) < header_size:
+        raise ValueError("%s is not a shared readings file" % self.path)
+      header = frombuffer(start, header_type, 1)[0]
+      if header["magic"] != magic:
+        raise ValueError("%s is not a shared readings file" % self.path)
+      if header["version"] != version:
+        raise ValueError("%s has layout version %d, not %d" %
+                         (self.path, header["version"], version))
+      num_heads = int(header["num_heads"])
+      self.capacity = int(header["capacity"])
+      keys, times, power, size = layout(num_heads, self.capacity)
+      if status.st_size < size:
+        raise ValueError("%s has %d bytes, not %d" %
+                         (self.path, status.st_size, size))
+      self._inode = status.st_ino
+      self._mapped = memmap(fd, mode=mode, shape=(size,))
+    self._header = ndarray((), header_type, self._mapped, 0)
+    self.keys = list(ndarray((num_heads,), int32, self._mapped, keys))
+    self.times = ndarray((self.capacity,), float64, self._mapped, times)
+    self.power = ndarray((self.capacity, num_heads), float64, self._mapped,
+                         power)
+
+  def _detach(self):
+    """
+    Drops the array views so that the file is unmapped
+    """
+    del self.times, self.power, self._header, self._mapped
+
+  @property
+  def count(self):
+    """
+    Number of epochs written, i.e. the sequence number of the next epoch
+    """
+    return int(self._header["count"])
+
+
+class SharedReadings(_SharedBuffer):
+  """
+  Writer of the shared readings file, used by the server
+  """
+  def __init__(self, keys, capacity=4096, path=default_path):
+    """
+    @param keys : head indices, e.g. Poller.keys
+    @type  keys : list of int
+
+    @param capacity : number of epochs kept
+    @type  capacity : int
+
+    @param path : name of the file; replaced if it exists
+    @type  path : str
+    """
+    self.logger = logging.getLogger(logger.name+".SharedReadings")
+    self.path = path
+    offsets = layout(len(keys), capacity)
+    directory = os.path.dirname(path) or "."
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    # build the file aside so that a reader never maps a partial header
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmpfile:
+      header = zeros((), header_type)
+      header["magic"] = magic
+      header["version"] = version
+      header["num_heads"] = len(keys)
+      header["capacity"] = capacity
+      tmpfile.write(header.tostring().ljust(header_size, "\0"))
+      tmpfile.write(array(keys, int32).tostring())
+      tmpfile.truncate(offsets[-1])
+    os.rename(tmpname, path)
+    self._attach(mode="r+")
+    self.logger.debug("__init__: %d heads, %d epochs in %s",
+                      len(self.keys), self.capacity, path)
+
+  def append(self, timestamp, readings):
+    """
+    Stores the readings of one epoch, overwriting the oldest if full
+
+    @param timestamp : epoch time
+    @type  timestamp : float
+
+    @param readings : one reading per head in the order of 'keys'
+    @type  readings : sequence of float
+    """
+    count = self.count
+    index = count % self.capacity
+    self.times[index] = timestamp
+    self.power[index] = readings
+    # publish only after the slot is complete
+    self._header["count"] = count+1
+
+  def close(self, remove=False):
+    """
+    Unmaps the file and optionally deletes it
+    """
+    self._mapped.flush()
+    self._detach()
+    if remove:
+      os.remove(self.path)
+
+
+class SharedReadingsReader(_SharedBuffer):
+  """
+  Reader of the shared readings file
+
+  The 'times' and 'power' attributes are zero-copy views of the whole ring;
+  latest() and since() return consistent copies of the epochs asked for.
+  """
+  def __init__(self, path=default_path):
+    """
+    @param path : name of the file written by SharedReadings
+    @type  path : str
+    """
+    self.logger = logging.getLogger(logger.name+".SharedReadingsReader")
+    self.path = path
+    self._attach(mode="r")
+
+  def stale(self):
+    """
+    True if the file has been replaced, e.g. by a restarted server
+    """
+    try:
+      return os.stat(self.path).st_ino != self._inode
+    except OSError:
+      return True
+
+  def oldest(self):
+    """
+    Sequence number of the oldest epoch which cannot be overwritten while
+    it is being read
+    """
+    return max(self.count+1-self.capacity, 0)
+
+  def latest(self):
+    """
+    Returns the time and readings of the last epoch, or None
+    """
+    while True:
+      count = self.count
+      if not count:
+        return None
+      index = (count-1) % self.capacity
+      timestamp, readings = self.times[index], self.power[index].copy()
+      if self.oldest() <= count-1:
+        return timestamp, readings
+
+  def since(self, seq, max_n=None):
+    """
+    Returns the epochs with sequence numbers from 'seq' on
+
+    Epochs which were overwritten before or while they were copied are
+    skipped, so the first epoch returned may be later than 'seq'.
+
+    @param seq : sequence number of the first epoch wanted
+    @type  seq : int
+
+    @param max_n : largest number of epochs returned
+    @type  max_n : int
+
+    @return: (sequence number of the first epoch returned, times, power)
+    """
+    last = self.count
+    first = min(max(seq, self.oldest()), last)
+    if max_n != None:
+      last = min(last, first+max_n)
+    index = arange(first, last) % self.capacity
+    times, power = self.times[index], self.power[index]
+    intact = max(self.oldest()-first, 0)
+    return first+intact, times[intact:], power[intact:]
+
+  def close(self):
+    """
+    Unmaps the file
+    """
+    self._detach()
@@ -0,0 +1,183 @@
+"""
+Push delivery of radiometer readings to subscribers
+
+Each subscriber gets its own queue and delivery thread so that a slow or
+dead subscriber never holds up acquisition.  If its queue fills, the
+subscriber's decimation is doubled; if that does not help, it is dropped.
+
+A subscriber is a callable or an object, typically a Pyro4.Proxy, with a
+'push' method.  It is called with batches like those of
+RadiometerServer.get_readings_since()::
+  {"keys": [0, 1, ...], "first": 1200, "decimate": 1,
+   "time": [...], "power": [[...], [...], ...]}
+"""
+import logging
+import threading
+import time
+import Queue
+
+logger = logging.getLogger(__name__)
+
+class Subscription(object):
+  """
+  One subscriber with its queue and delivery thread
+
+  Public attributes::
+    decimate  - one epoch in this many is delivered
+    delivered - number of batches delivered
+    dropped   - True when the subscriber has been dropped
+    failures  - number of consecutive failed deliveries
+    overflows - number of batches which did not fit in the queue
+  """
+  def __init__(self, callback, keys, decimate=1, batch_size=10,
+               batch_interval=1., max_queue=16, max_decimate=64,
+               max_failures=3, name="subscriber"):
+    """
+    @param callback : called with each batch
+    @type  callback : callable or object with a 'push' method
+
+    @param keys : head indices in the order of the readings
+    @type  keys : list of int
+
+    @param decimate : deliver one epoch in this many
+    @type  decimate : int
+
+    @param batch_size : deliver when a batch has this many epochs
+    @type  batch_size : int
+
+    @param batch_interval : or when the oldest epoch is this many s old
+    @type  batch_interval : float
+
+    @param max_queue : batches waiting before the queue overflows
+    @type  max_queue : int
+
+    @param max_decimate : drop the subscriber rather than decimate more
+    @type  max_decimate : int
+
+    @param max_failures : drop after this many consecutive failed deliveries
+    @type  max_failures : int
+    """
+    self.logger = logging.getLogger(logger.name+".Subscription")
+    self.name = name
+    if hasattr(callback, "push"):
+      self._push = callback.push
+    else:
+      self._push = callback
+    self._callback = callback
+    self.keys = list(keys)
+    self.decimate = max(1, int(decimate))
+    self.batch_size = batch_size
+    self.batch_interval = batch_interval
+    self.max_decimate = max_decimate
+    self.max_failures = max_failures
+    self.delivered = 0
+    self.failures = 0
+    self.overflows = 0
+    self.dropped = False
+    self._queue = Queue.Queue(max_queue)
+    self._lock = threading.Lock() # for the batch being filled
+    self._new_batch()
+    self._thread = threading.Thread(target=self._deliver,
+                                    name="subscription-"+name)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _new_batch(self):
+    """
+    Starts an empty batch
+    """
+    self._first = None
+    self._started = None
+    self._times = []
+    self._power = []
+
+  def offer(self, seq, timestamp, readings):
+    """
+    Adds an epoch if it is not decimated away; never blocks
+
+    @param seq : sequence number of the epoch
+    @param timestamp : epoch time
+    @param readings : readings in the order of 'keys'
+    """
+    if self.dropped or seq % self.decimate:
+      return
+    with self._lock:
+      if self._first == None:
+        self._first = seq
+        self._started = time.time()
+      self._times.append(timestamp)
+      self._power.append([float(reading) for reading in readings])
+      if len(self._times) >= self.batch_size:
+        self._flush()
+
+  def _flush(self):
+    """
+    Queues the current batch, decimating more or dropping on overflow
+
+    The lock must be held.
+    """
+    batch = {"keys": self.keys, "first": self._first,
+             "decimate": self.decimate, "time": self._times,
+             "power": [list(column) for column in zip(*self._power)]}
+    self._new_batch()
+    try:
+      self._queue.put_nowait(batch)
+    except Queue.Full:
+      self.overflows += 1
+      if self.decimate*2 > self.max_decimate:
+        self.logger.warning("_flush: dropping %s; cannot keep up", self.name)
+        self.close()
+      else:
+        self.decimate *= 2
+        self.logger.warning("_flush: %s is slow; decimating by %d",
+                            self.name, self.decimate)
+
+  def _deliver(self):
+    """
+    Delivers queued batches until closed
+    """
+    claim = getattr(self._callback, "_pyroClaimOwnership", None)
+    if claim:
+      # a Pyro4 proxy may only be used by one thread
+      claim()
+    while not self.dropped:
+      try:
+        batch = self._queue.get(timeout=self.batch_interval/2.)
+      except Queue.Empty:
+        # send a partial batch which has waited long enough
+        with self._lock:
+          if self._first != None and \
+             time.time()-self._started >= self.batch_interval:
+            self._flush()
+        continue
+      if batch == None:
+        break
+      try:
+        self._push(batch)
+      except Exception, details:
+        self.failures += 1
+        self.logger.error("_deliver: %s failed: %s", self.name, details)
+        if self.failures >= self.max_failures:
+          self.logger.warning("_deliver: dropping %s", self.name)
+          self.dropped = True
+      else:
+        self.failures = 0
+        self.delivered += 1
+
+  def close(self):
+    """
+    Stops delivery; batches still queued are discarded
+    """
+    self.dropped = True
+    try:
+      self._queue.put_nowait(None)
+    except Queue.Full:
+      pass
+
+  def status(self):
+    """
+    Returns the counters as a dict
+    """
+    return {"name": self.name, "decimate": self.decimate,
+            "delivered": self.delivered, "overflows": self.overflows,
+            "queued": self._queue.qsize(), "dropped": self.dropped}
@@ -0,0 +1,75 @@
+"""
+USB serial adapter information from sysfs
+
+Each /sys/class/tty/ttyUSB* entry has a 'device' link to the usb-serial
+port, e.g. .../1-1.2/1-1.2:1.0/ttyUSB0, whose parent is the USB interface
+(1-1.2:1.0).  The USB device is the nearest ancestor with an 'idVendor'
+file; its directory name gives its place in the bus topology (e.g. '1-1.2')
+and it may have a 'serial' file.  None of this requires opening the tty.
+"""
+import logging
+import os
+from glob import glob
+
+logger = logging.getLogger(__name__)
+
+def _read(directory, name):
+  """
+  Returns the stripped contents of a sysfs attribute file or None
+  """
+  try:
+    with open(os.path.join(directory, name)) as fd:
+      return fd.read().strip()
+  except IOError:
+    return None
+
+def _usb_device(directory):
+  """
+  Returns the nearest directory at or above 'directory' with an 'idVendor'
+  file, or None
+  """
+  while directory != os.path.dirname(directory):
+    if os.path.exists(os.path.join(directory, "idVendor")):
+      return directory
+    directory = os.path.dirname(directory)
+  return None
+
+def usb_ports(pattern="/sys/class/tty/ttyUSB*"):
+  """
+  Returns USB adapter properties for every ttyUSB port
+
+  Ports which are not on a USB device are left out.  An example of one
+  item::
+    "/dev/ttyUSB0": {"serial": "FT1ABCDE", "topology": "1-1.2",
+                     "vendor": "0403", "product": "6001"}
+
+  @param pattern : glob for the tty class entries
+  @type  pattern : str
+
+  @return: dict keyed by device name
+  """
+  ports = {}
+  for entry in glob(pattern):
+    usbdev = _usb_device(os.path.realpath(os.path.join(entry, "device")))
+    if not usbdev:
+      logger.debug("usb_ports: no USB device for %s", entry)
+      continue
+    ports["/dev/"+os.path.basename(entry)] = {
+      "serial":   _read(usbdev, "serial"),
+      "topology": os.path.basename(usbdev),
+      "vendor":   _read(usbdev, "idVendor"),
+      "product":  _read(usbdev, "idProduct")}
+  logger.debug("usb_ports: %s", ports)
+  return ports
+
+def port_key(usb):
+  """
+  Returns the key under which an adapter is remembered
+
+  The adapter serial number follows the head to any socket.  Adapters
+  without one are identified by their place in the USB topology.
+  """
+  if usb["serial"]:
+    return "serial:"+usb["serial"]
+  else:
+    return "topology:"+usb["topology"]
@@ -0,0 +1,176 @@
+import glob
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from Electronics.Instruments.Radipower.datafile import BinaryWriter, \
+    BlockFile, DataWriter, load_records, open_binary
+
+class TestDataWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self, pattern="RM*.csv"):
+        return sorted(glob.glob(os.path.join(self.directory, pattern)))
+
+    def test_write(self):
+        writer = DataWriter(self.directory, [0, 3], 1., batch_size=2)
+        writer.put(1462276800.25, [-35.1, float("nan")])
+        writer.put(1462276801.25, [-35.2, -40.])
+        writer.close()
+        self.assertEqual(writer.written, 2)
+        files = self.files()
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ["RM2016-124-120000.csv"])
+        lines = open(files[0]).read().splitlines()
+        self.assertEqual(lines[1], "# rate: 1.0 epochs/s")
+        self.assertEqual(lines[2], "date,time,PM00,PM03")
+        self.assertEqual(lines[3], "2016-05-03,12:00:00.250,-35.100,nan")
+
+    def test_rotate(self):
+        writer = DataWriter(self.directory, [0], 1.)
+        writer.put(1462276800., [-35.])
+        writer.rotate(rate=10.)
+        writer.put(1462276810., [-35.])
+        writer.put(1462276810.1, [-35.])
+        writer.close()
+        files = self.files()
+        self.assertEqual(len(files), 2)
+        self.assertEqual(self.files("*.part"), [])
+        self.assertTrue("# rate: 10.0 epochs/s" in open(files[1]).read())
+
+    def test_max_bytes(self):
+        writer = DataWriter(self.directory, [0], 1., batch_size=1,
+                            max_bytes=100)
+        for second in range(5):
+            writer.put(1462276800. + second, [-35.])
+        writer.close()
+        self.assertTrue(len(self.files()) > 1)
+
+    def test_dropped(self):
+        writer = DataWriter(self.directory, [0], 1., max_queue=1)
+        for second in range(1000):
+            writer.put(1462276800. + second, [-35.])
+        writer.close()
+        self.assertEqual(writer.written + writer.dropped, 1000)
+        self.assertTrue(writer.dropped > 0)
+
+class TestBinaryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_open_binary(self):
+        metadata = {0: {"ID": "1.99.234.24.23.0.0.212", "model": "RPR2006C"}}
+        writer = BinaryWriter(self.directory, [0, 3], 1., batch_size=2,
+                              metadata=metadata)
+        for second in range(5):
+            writer.put(1462276800. + second, [-35. - second, np.nan])
+        writer.close()
+        filename, = glob.glob(os.path.join(self.directory, "RM*.rpd"))
+        header, records = open_binary(filename)
+        self.assertEqual(header["keys"], [0, 3])
+        self.assertEqual(header["heads"]["0"]["model"], "RPR2006C")
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records["time"][1], 1462276801.)
+        self.assertEqual(list(records["power"][:, 0]), [-35., -36., -37.,
+                                                        -38., -39.])
+        self.assertTrue(np.isnan(records["power"][:, 1]).all())
+
+    def test_partial_record(self):
+        writer = BinaryWriter(self.directory, [0], 1.)
+        writer.put(1462276800., [-35.])
+        writer.close()
+        filename, = glob.glob(os.path.join(self.directory, "RM*.rpd"))
+        with open(filename, "ab") as fd:
+            fd.write("\0" * 5)
+        header, records = open_binary(filename)
+        self.assertEqual(len(records), 1)
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, cls, compression, num=100, **kwargs):
+        writer = cls(self.directory, [0, 1], 1., batch_size=10,
+                     compression=compression, **kwargs)
+        for second in range(num):
+            writer.put(1462276800. + second, [-35. - second, -40.])
+        return writer
+
+    def test_csv(self):
+        self.write(DataWriter, "bz2", block_size=1).close()
+        filename, = glob.glob(os.path.join(self.directory, "RM*.csv.blk"))
+        blocks = BlockFile(filename)
+        self.assertEqual(blocks.codec, "bz2")
+        self.assertEqual(len(blocks.index), 11)
+        self.assertTrue(blocks.header().endswith("date,time,PM00,PM01\n"))
+        lines = blocks.read(1462276825., 1462276835.).splitlines()
+        # whole blocks of ten epochs
+        self.assertEqual(len(lines), 20)
+        self.assertTrue(lines[0].startswith("2016-05-03,12:00:20.000,-55.000"))
+
+    def test_block_size(self):
+        # 100 epochs of CSV are much less than the default block size, so
+        # the header and one block of epochs written at close
+        self.write(DataWriter, "zlib").close()
+        filename, = glob.glob(os.path.join(self.directory, "RM*.csv.blk"))
+        blocks = BlockFile(filename)
+        self.assertEqual(list(blocks.index["count"]), [0, 100])
+        self.assertEqual(len(blocks.read().splitlines()), 100)
+
+    def test_block_interval(self):
+        # held epochs are written as a block long before the file is closed
+        writer = self.write(DataWriter, "zlib", num=5, flush_interval=0.05,
+                            block_interval=0.1)
+        deadline = time.time() + 5
+        while writer.written < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        with writer.lock:
+            lines = BlockFile(writer.filename + ".part").read().splitlines()
+        writer.close()
+        self.assertEqual(len(lines), 5)
+
+    def test_binary_range(self):
+        self.write(BinaryWriter, "zlib").close()
+        filename, = glob.glob(os.path.join(self.directory, "RM*.rpd.blk"))
+        header, records = load_records(filename, 1462276825., 1462276835.)
+        self.assertEqual(header["keys"], [0, 1])
+        self.assertEqual(list(records["time"] - 1462276800.), range(25, 36))
+
+    def test_unfinished(self):
+        writer = self.write(BinaryWriter, "zlib", block_size=1)
+        writer.close()
+        filename, = glob.glob(os.path.join(self.directory, "RM*.rpd.blk"))
+        with open(filename, "rb") as fd:
+            data = fd.read()
+        # drop the index and half of the last block
+        part = filename + ".part"
+        with open(part, "wb") as fd:
+            fd.write(data[:int(BlockFile(filename).index["offset"][-1]) + 30])
+        blocks = BlockFile(part)
+        self.assertEqual(len(blocks.index), 10)
+        header, records = load_records(part)
+        self.assertEqual(len(records), 90)
+
+    def test_bad_codec(self):
+        self.assertRaises(ValueError, DataWriter, self.directory, [0], 1.,
+                          compression="lzw")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from Electronics.Instruments.Radipower.catalog import Catalog
+from Electronics.Instruments.Radipower.datafile import BinaryWriter, DataWriter
+from Electronics.Instruments.Radipower.history import count_epochs, \
+    history, read_range
+
+start = 1462276800.
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, cls=DataWriter, keys=[0, 1], first=0, num=100, **kwargs):
+        writer = cls(self.directory, keys, 1., batch_size=10, **kwargs)
+        for second in range(first, first + num):
+            writer.put(start + second, [-second] * len(keys))
+        writer.close()
+        return writer
+
+    def test_catalog(self):
+        self.write(first=0)
+        self.write(first=200, compression="zlib")
+        catalog = Catalog(self.directory)
+        entry = catalog.entries["RM2016-124-120000.csv"]
+        self.assertEqual(entry["epochs"], 100)
+        self.assertEqual(entry["stop"], start + 99)
+        names = [os.path.basename(f) for f in catalog.files(start + 50)]
+        self.assertEqual(names, ["RM2016-124-120000.csv",
+                                 "RM2016-124-120320.csv.blk"])
+        self.assertEqual(catalog.files(start + 100, start + 199), [])
+        self.assertTrue(os.path.exists(os.path.join(
+            self.directory, "RM2016-124-120000.csv.idx")))
+
+    def test_read_range(self):
+        self.write()
+        keys, times, power = read_range(
+            os.path.join(self.directory, "RM2016-124-120000.csv"),
+            start + 25, start + 34)
+        self.assertEqual(keys, [0, 1])
+        self.assertEqual(list(times - start), range(25, 35))
+        self.assertEqual(list(power[:, 1]), range(-25, -35, -1))
+
+    def test_history(self):
+        self.write(keys=[0, 1], first=0)
+        self.write(BinaryWriter, keys=[1, 2], first=100)
+        self.write(keys=[0, 1], first=200, compression="bz2")
+        keys, times, power = history(self.directory, start + 90, start + 210,
+                                     keys=[1, 2], decimate=10)
+        self.assertEqual(keys, [1, 2])
+        self.assertEqual(list(times - start), range(90, 220, 10))
+        self.assertEqual(power[0, 0], -90.)
+        self.assertTrue(np.isnan(power[0, 1]))
+        self.assertEqual(power[2, 1], -110.)
+
+    def test_max_n(self):
+        self.write(first=0)
+        self.write(first=200, compression="zlib")
+        estimate = count_epochs(self.directory, start + 50, start + 249)
+        self.assertTrue(98 <= estimate <= 102)
+        keys, times, power = history(self.directory, start, start + 299,
+                                     decimate=5, max_n=30)
+        # decimated in step across the files and cut off at max_n
+        self.assertEqual(list(times - start),
+                         range(0, 100, 5) + range(200, 250, 5))
+
+    def test_current(self):
+        writer = DataWriter(self.directory, [0, 1], 1., batch_size=10)
+        for second in range(20):
+            writer.put(start + second, [-second] * 2)
+        deadline = time.time() + 5
+        while writer.written < 20 and time.time() < deadline:
+            time.sleep(0.01)
+        keys, times, power = history(self.directory, start + 5, start + 14,
+                                     writer=writer)
+        writer.close()
+        self.assertEqual(keys, [0, 1])
+        self.assertEqual(list(times - start), range(5, 15))
+
+if __name__ == "__main__":
+    unittest.main()
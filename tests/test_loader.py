@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Electronics.Instruments.Radipower.datafile import DataWriter
+from Electronics.Instruments.Radipower.loader import data_files, \
+    iter_chunks, load
+
+start = 1462276800.
+
+class TestLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_rm(self, num=25):
+        writer = DataWriter(self.directory, [0, 3], 1.)
+        for second in range(num):
+            writer.put(start + second + 0.25, [-second, np.nan])
+        writer.close()
+        return os.path.join(self.directory, "RM2016-124-120000.csv")
+
+    def test_rm(self):
+        filename = self.write_rm()
+        keys, times, power = load(filename, chunk_lines=10)
+        self.assertEqual(keys, [0, 3])
+        self.assertEqual(list(times - start), [s + 0.25 for s in range(25)])
+        self.assertEqual(power[24, 0], -24.)
+        self.assertTrue(np.isnan(power[:, 1]).all())
+
+    def test_cache(self):
+        filename = self.write_rm()
+        load(filename)
+        self.assertTrue(os.path.exists(filename + ".npy"))
+        self.assertEqual(data_files(os.path.join(self.directory, "RM*")),
+                         [filename])
+        keys, times, power = load(filename)
+        self.assertEqual(keys, [0, 3])
+        self.assertEqual(power[24, 0], -24.)
+
+    def test_decimate(self):
+        filename = self.write_rm()
+        keys, times, power = load(filename, chunk_lines=7, decimate=3,
+                                  cache=False)
+        self.assertEqual(list(power[:, 0]), range(0, -25, -3))
+
+    def test_pm(self):
+        filename = os.path.join(self.directory, "PM00")
+        with open(filename, "w") as fd:
+            fd.write("2016/05/03 12:00:00 -35.5\n")
+            fd.write("2016/05/03 12:00:01.5 -35.7\n")
+            fd.write("2016/05/03 12:00:0")
+        for name in ("PM01-trace.npy", "PM01-trace.npy.verbs"):
+            open(os.path.join(self.directory, name), "w").close()
+        self.assertEqual(data_files(os.path.join(self.directory, "PM*")),
+                         [filename])
+        chunks = list(iter_chunks(filename))
+        keys, times, power = chunks[0]
+        self.assertEqual(keys, None)
+        self.assertEqual(list(times - start), [0., 1.5])
+        self.assertEqual(list(power[:, 0]), [-35.5, -35.7])
+
+if __name__ == "__main__":
+    unittest.main()
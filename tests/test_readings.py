@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from Electronics.Instruments.Radipower.readings import ReadingBuffer
+
+class TestReadingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = ReadingBuffer([0, 1, 2], capacity=10)
+
+    def fill(self, num):
+        for i in range(num):
+            self.buffer.append(100. + i, [i, 2 * i, np.nan])
+
+    def test_empty(self):
+        self.assertEqual(self.buffer.latest(), None)
+        self.assertEqual(self.buffer.statistics()["count"], 0)
+
+    def test_wrap_around(self):
+        self.fill(25)
+        times, power = self.buffer.window()
+        self.assertEqual(list(times), [115. + i for i in range(10)])
+        self.assertEqual(power[-1, 1], 48.)
+        timestamp, readings = self.buffer.latest()
+        self.assertEqual(timestamp, 124.)
+
+    def test_window_seconds(self):
+        self.fill(8)
+        times, power = self.buffer.window(seconds=2.5)
+        self.assertEqual(list(times), [105., 106., 107.])
+
+    def test_since(self):
+        self.fill(25)
+        first, times, power = self.buffer.since(0)
+        self.assertEqual(first, 15)
+        self.assertEqual(len(times), 10)
+        first, times, power = self.buffer.since(20, max_n=3)
+        self.assertEqual(first, 20)
+        self.assertEqual(list(times), [120., 121., 122.])
+        first, times, power = self.buffer.since(25)
+        self.assertEqual((first, len(times)), (25, 0))
+
+    def test_since_new_buffer(self):
+        # a client still following a buffer which has been replaced
+        self.fill(5)
+        first, times, power = self.buffer.since(1000)
+        self.assertEqual((first, len(times)), (0, 5))
+        self.assertNotEqual(self.buffer.session,
+                            ReadingBuffer([0, 1, 2]).session)
+
+    def test_statistics(self):
+        self.fill(4)
+        stats = self.buffer.statistics(num=4)
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["mean"][0], 1.5)
+        self.assertEqual(stats["max"][1], 6.)
+        self.assertTrue(np.isnan(stats["mean"][2]))
+
+if __name__ == "__main__":
+    unittest.main()
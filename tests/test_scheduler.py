@@ -0,0 +1,69 @@
+import threading
+import time
+import unittest
+
+from Electronics.Instruments.Radipower import scheduler as scheduler_module
+from Electronics.Instruments.Radipower.scheduler import EpochScheduler, \
+    monotonic
+
+class TestEpochScheduler(unittest.TestCase):
+
+    def test_monotonic(self):
+        first = monotonic()
+        time.sleep(0.01)
+        self.assertTrue(monotonic() - first >= 0.009)
+
+    def test_aligned(self):
+        scheduler = EpochScheduler(20.)
+        starts = [scheduler.wait() for i in range(5)]
+        for start in starts:
+            self.assertAlmostEqual(start * 20., round(start * 20.), places=6)
+        for earlier, later in zip(starts, starts[1:]):
+            self.assertAlmostEqual(later - earlier, 0.05, places=6)
+        self.assertTrue(abs(time.time() - starts[-1]) < 0.04)
+
+    def test_set_rate_while_waiting(self):
+        # set_rate() from another thread in the middle of wait()
+        scheduler = EpochScheduler(20.)
+        scheduler.wait()
+        time.sleep(0.06) # so that the next epoch is due at once
+        clock = scheduler_module.monotonic
+        calls = []
+        def monotonic():
+            calls.append(threading.Thread(target=scheduler.set_rate,
+                                          args=(10.,)))
+            if len(calls) == 2: # after the schedule is read
+                calls[-1].start()
+                calls[-1].join(0.05)
+            return clock()
+        scheduler_module.monotonic = monotonic
+        try:
+            self.assertTrue(scheduler.wait() != None)
+        finally:
+            scheduler_module.monotonic = clock
+            calls[1].join()
+        self.assertEqual(scheduler.rate, 10.)
+
+    def test_overrun(self):
+        scheduler = EpochScheduler(20.)
+        first = scheduler.wait()
+        time.sleep(0.12)
+        second = scheduler.wait()
+        self.assertTrue(second - first > 0.149)
+        self.assertTrue(scheduler.missed >= 2)
+
+    def test_set_rate(self):
+        scheduler = EpochScheduler(20.)
+        scheduler.wait()
+        scheduler.set_rate(10.)
+        start = scheduler.wait()
+        self.assertAlmostEqual(start * 10., round(start * 10.), places=6)
+        self.assertRaises(ValueError, scheduler.set_rate, 0)
+
+    def test_stop(self):
+        scheduler = EpochScheduler(1. / 60)
+        threading.Timer(0.05, scheduler.stop).start()
+        self.assertEqual(scheduler.wait(), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Electronics.Instruments.Radipower.sharedmem import SharedReadings, \
+    SharedReadingsReader
+
+class TestSharedReadings(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "radiometer")
+        self.writer = SharedReadings([3, 1, 2], capacity=10, path=self.path)
+        self.reader = SharedReadingsReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def fill(self, num):
+        for i in range(num):
+            self.writer.append(100. + i, [i, 2 * i, np.nan])
+
+    def test_header(self):
+        self.assertEqual(self.reader.keys, [3, 1, 2])
+        self.assertEqual(self.reader.capacity, 10)
+        self.assertEqual(self.reader.latest(), None)
+
+    def test_latest(self):
+        self.fill(25)
+        timestamp, readings = self.reader.latest()
+        self.assertEqual(timestamp, 124.)
+        self.assertEqual(list(readings[:2]), [24., 48.])
+
+    def test_since(self):
+        self.fill(25)
+        first, times, power = self.reader.since(0)
+        # the oldest slot is next to be written so is not returned
+        self.assertEqual(first, 16)
+        self.assertEqual(list(times), [116. + i for i in range(9)])
+        first, times, power = self.reader.since(20, max_n=3)
+        self.assertEqual(first, 20)
+        self.assertEqual(list(power[:, 1]), [40., 42., 44.])
+
+    def test_stale(self):
+        self.assertFalse(self.reader.stale())
+        SharedReadings([0], capacity=10, path=self.path).close()
+        self.assertTrue(self.reader.stale())
+
+    def test_not_shared(self):
+        with open(self.path, "wb") as fd:
+            fd.write("x" * 200)
+        self.assertRaises(ValueError, SharedReadingsReader, self.path)
+
+if __name__ == "__main__":
+    unittest.main()
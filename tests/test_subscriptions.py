@@ -0,0 +1,62 @@
+import time
+import unittest
+
+from Electronics.Instruments.Radipower.subscriptions import Subscription
+
+class Collector(object):
+
+    def __init__(self, delay=0.):
+        self.batches = []
+        self.delay = delay
+
+    def push(self, batch):
+        time.sleep(self.delay)
+        self.batches.append(batch)
+
+class TestSubscription(unittest.TestCase):
+
+    def wait(self, test, timeout=2.):
+        start = time.time()
+        while not test() and time.time() - start < timeout:
+            time.sleep(0.01)
+
+    def test_batches(self):
+        collector = Collector()
+        sub = Subscription(collector, [0, 1], decimate=2, batch_size=3)
+        for seq in range(12):
+            sub.offer(seq, 100. + seq, [seq, -seq])
+        self.wait(lambda: len(collector.batches) == 2)
+        sub.close()
+        batch = collector.batches[0]
+        self.assertEqual(batch["first"], 0)
+        self.assertEqual(batch["time"], [100., 102., 104.])
+        self.assertEqual(batch["power"], [[0., 2., 4.], [0., -2., -4.]])
+
+    def test_partial_batch(self):
+        collector = Collector()
+        sub = Subscription(collector, [0], batch_size=100, batch_interval=0.1)
+        sub.offer(0, 100., [1.])
+        self.wait(lambda: collector.batches)
+        sub.close()
+        self.assertEqual(collector.batches[0]["time"], [100.])
+
+    def test_slow_subscriber(self):
+        collector = Collector(delay=0.5)
+        sub = Subscription(collector, [0], batch_size=1, max_queue=2,
+                           max_decimate=4)
+        for seq in range(100):
+            sub.offer(seq, 100. + seq, [1.])
+        self.assertTrue(sub.dropped)
+        self.assertEqual(sub.decimate, 4)
+
+    def test_failing_subscriber(self):
+        def callback(batch):
+            raise IOError("gone")
+        sub = Subscription(callback, [0], batch_size=1, max_failures=2)
+        for seq in range(3):
+            sub.offer(seq, 100. + seq, [1.])
+        self.wait(lambda: sub.dropped)
+        self.assertTrue(sub.dropped)
+
+if __name__ == "__main__":
+    unittest.main()
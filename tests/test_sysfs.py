@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Electronics.Instruments.Radipower.sysfs import port_key, usb_ports
+
+class TestUSBPorts(unittest.TestCase):
+
+    def setUp(self):
+        # a sysfs-like tree: device 1-1.2, interface 1-1.2:1.0, port ttyUSB0
+        self.root = tempfile.mkdtemp()
+        usbdev = os.path.join(self.root, "devices", "usb1", "1-1", "1-1.2")
+        port = os.path.join(usbdev, "1-1.2:1.0", "ttyUSB0")
+        os.makedirs(port)
+        for name, value in (("idVendor", "0403"), ("idProduct", "6001"),
+                            ("serial", "FT1ABCDE")):
+            with open(os.path.join(usbdev, name), "w") as fd:
+                fd.write(value + "\n")
+        tty = os.path.join(self.root, "class", "tty", "ttyUSB0")
+        os.makedirs(tty)
+        os.symlink(port, os.path.join(tty, "device"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_usb_ports(self):
+        ports = usb_ports(os.path.join(self.root, "class", "tty", "ttyUSB*"))
+        self.assertEqual(ports, {"/dev/ttyUSB0": {
+            "serial": "FT1ABCDE", "topology": "1-1.2",
+            "vendor": "0403", "product": "6001"}})
+        self.assertEqual(port_key(ports["/dev/ttyUSB0"]), "serial:FT1ABCDE")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import logging
+import time
+import unittest
+
+import numpy as np
+
+from Electronics.Instruments.Radipower.emulator import RadipowerEmulator
+from Electronics.Instruments.Radipower.workers import group_ports, WorkerPool
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = RadipowerEmulator(2, power=-35.)
+        ports = dict([(port, index) for index, port
+                      in enumerate(self.emulator.ports())])
+        self.pool = WorkerPool(ports, 10.)
+
+    def tearDown(self):
+        self.pool.close()
+        self.emulator.close()
+
+    def test_group_ports(self):
+        self.assertEqual(group_ports(["b", "a"]), [["a"], ["b"]])
+        self.assertRaises(ValueError, group_ports, ["a"], by="phase")
+
+    def test_read(self):
+        self.assertEqual(self.pool.keys, [0, 1])
+        # allow for the workers to find their heads
+        deadline = time.time() + 10.
+        readings = np.array([np.nan])
+        while np.isnan(readings).any() and time.time() < deadline:
+            time.sleep(0.1)
+            stop = np.floor(time.time() * 10.) / 10.
+            timestamp, readings = self.pool.read(stop - 0.1, stop)
+        self.assertTrue(((readings > -40.) & (readings < -30.)).all())
+        self.assertTrue(stop - 0.1 <= timestamp < stop)
+        self.assertEqual(self.pool.status().values(), [True, True])
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    unittest.main()
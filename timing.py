@@ -0,0 +1,253 @@
+"""
+Empirical Radipower timing from live traffic
+
+The vendor's model (Radipower.predict_read_time) ignores USB latency and
+hub contention, which dominate on our controllers.  Each head therefore
+records how long its POWER? round trips actually take, separately for each
+combination of FILTER, ACQ_SPEED and BAUD, in log-spaced histograms from
+which percentiles are estimated.  The histograms are kept in a JSON file so
+that they survive restarts::
+  {"1.99.234.24.23.0.0.212": {"3/1000/1": {"counts": [...], "total": 12.3},
+                              ...}, ...}
+"""
+import logging
+import os
+from math import log10
+
+from Electronics.Instruments.Radipower.cache import JSONCache, cache_dir
+
+logger = logging.getLogger(__name__)
+
+class Histogram(object):
+  """
+  Latency histogram with logarithmic bins
+
+  With the default 20 bins per decade each bin is about 12% wide.
+  The first and last bins collect values outside the range.
+
+  Public attributes::
+    counts - number of values in each bin
+    total  - sum of the values
+  """
+  low = 1e-5      # s
+  high = 100.     # s
+  per_decade = 20
+
+  def __init__(self, counts=None, total=0.):
+    """
+    @param counts : previously saved bin counts
+    @type  counts : list of int
+
+    @param total : previously saved sum of values
+    @type  total : float
+    """
+    self._offset = log10(self.low)
+    nbins = int(round((log10(self.high)-self._offset)*self.per_decade))+2
+    if counts and len(counts) == nbins:
+      self.counts = list(counts)
+    else:
+      self.counts = [0]*nbins
+    self.total = total
+
+  def add(self, value):
+    """
+    Adds a value in s
+    """
+    if value > 0:
+      index = int((log10(value)-self._offset)*self.per_decade)+1
+      index = min(max(index, 0), len(self.counts)-1)
+    else:
+      index = 0
+    self.counts[index] += 1
+    self.total += value
+
+  def count(self):
+    """
+    Number of values added
+    """
+    return sum(self.counts)
+
+  def mean(self):
+    """
+    Mean value or None if there are none
+    """
+    number = self.count()
+    if number:
+      return self.total/number
+    return None
+
+  def percentile(self, p):
+    """
+    Estimated value below which 'p' percent of the values are, or None
+
+    The value is interpolated logarithmically within the bin.
+    """
+    number = self.count()
+    if not number:
+      return None
+    target = number*p/100.
+    cumulative = 0
+    for index, count in enumerate(self.counts):
+      if count and cumulative+count >= target:
+        break
+      cumulative += count
+    if index == 0:
+      return self.low
+    if index == len(self.counts)-1:
+      return self.high
+    fraction = (target-cumulative)/count
+    exponent = self._offset + (index-1+fraction)/float(self.per_decade)
+    return 10**exponent
+
+  def to_dict(self):
+    """
+    Returns the histogram in a form that can be saved as JSON
+    """
+    return {"counts": self.counts, "total": self.total}
+
+
+class TimingModel(object):
+  """
+  POWER? round trip times for one head keyed by settings
+
+  The key is 'FILTER/ACQ_SPEED/BAUD', e.g. '3/1000/1'.
+
+  Public attributes::
+    histograms - Histogram objects keyed by settings
+  """
+  def __init__(self, saved=None):
+    """
+    @param saved : histograms as returned by to_dict()
+    @type  saved : dict
+    """
+    self.histograms = {}
+    if saved:
+      for key, value in saved.items():
+        self.histograms[key] = Histogram(value["counts"], value["total"])
+
+  def record(self, key, seconds):
+    """
+    Adds one round trip time
+    """
+    try:
+      histogram = self.histograms[key]
+    except KeyError:
+      histogram = self.histograms[key] = Histogram()
+    histogram.add(seconds)
+
+  def read_time(self, key, p=50, min_count=10):
+    """
+    Returns the p-th percentile read time for a setting or None
+
+    None is returned if fewer than 'min_count' round trips were recorded.
+    """
+    histogram = self.histograms.get(key)
+    if histogram == None or histogram.count() < min_count:
+      return None
+    return histogram.percentile(p)
+
+  def summary(self, percentiles=(50, 90, 99)):
+    """
+    Returns count, mean and percentiles for every setting
+    """
+    result = {}
+    for key, histogram in self.histograms.items():
+      result[key] = {"count": histogram.count(), "mean": histogram.mean()}
+      for p in percentiles:
+        result[key]["p%d" % p] = histogram.percentile(p)
+    return result
+
+  def to_dict(self):
+    """
+    Returns the histograms in a form that can be saved as JSON
+    """
+    return dict([(key, histogram.to_dict())
+                 for key, histogram in self.histograms.items()])
+
+
+class TimingStore(JSONCache):
+  """
+  File of timing models for all heads keyed by ID_NUMBER
+  """
+  def __init__(self, path=os.path.join(cache_dir, "timing.json")):
+    """
+    @param path : name of the file; created when first saved
+    @type  path : str
+    """
+    super(TimingStore, self).__init__(path)
+    self._models = {}
+
+  def model(self, ID):
+    """
+    Returns the timing model for a head, creating it if necessary
+    """
+    if not self._models.has_key(ID):
+      with self._lock:
+        saved = self.entries.get(ID)
+      self._models[ID] = TimingModel(saved)
+    return self._models[ID]
+
+  def save(self):
+    """
+    Writes the models of all the heads seen
+    """
+    with self._lock:
+      for ID, model in self._models.items():
+        self.entries[ID] = model.to_dict()
+    super(TimingStore, self).save()
+
+
+class CommandStats(object):
+  """
+  Counts, latencies and errors of the commands sent to one head
+
+  Public attributes::
+    errors - number of error replies keyed by code, e.g. 'ERROR 1'
+    verbs  - [count, errors, Histogram] keyed by command verb
+  """
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    """
+    Clears all counters
+    """
+    self.verbs = {}
+    self.errors = {}
+
+  def _verb(self, verb):
+    """
+    Returns the counters for a verb, creating them if necessary
+    """
+    try:
+      return self.verbs[verb]
+    except KeyError:
+      counters = self.verbs[verb] = [0, 0, Histogram()]
+      return counters
+
+  def record(self, verb, seconds):
+    """
+    Counts one round trip
+    """
+    counters = self._verb(verb)
+    counters[0] += 1
+    counters[2].add(seconds)
+
+  def error(self, verb, code):
+    """
+    Counts one error reply
+    """
+    self._verb(verb)[1] += 1
+    self.errors[code] = self.errors.get(code, 0) + 1
+
+  def summary(self, percentiles=(50, 90, 99)):
+    """
+    Returns the counters as a dict of plain types
+    """
+    verbs = {}
+    for verb, (count, errors, histogram) in self.verbs.items():
+      verbs[verb] = {"count": count, "errors": errors,
+                     "mean": histogram.mean()}
+      for p in percentiles:
+        verbs[verb]["p%d" % p] = histogram.percentile(p)
+    return {"verbs": verbs, "errors": dict(self.errors)}
@@ -0,0 +1,80 @@
+"""
+Binary trace of Radipower exchanges
+
+Logging every reading at DEBUG level costs a measurable share of the CPU of
+a Raspberry Pi polling many heads, even when nothing is printed.  Instead
+each head writes one fixed-size record per exchange into a preallocated
+ring buffer, which costs about as much as a list append and can be dumped
+when something needs looking into.
+"""
+import logging
+
+from numpy import concatenate, nan, save, zeros
+
+logger = logging.getLogger(__name__)
+
+OK = 0
+ERROR = 1
+NO_REPLY = 2
+
+class TraceBuffer(object):
+  """
+  Ring buffer of exchange records
+
+  Each record has::
+    time    - when the reply was read (s since the epoch)
+    verb    - index into 'verbs' of the command verb
+    latency - round trip time in s
+    value   - the reading for POWER?, else NaN
+    status  - OK, ERROR or NO_REPLY
+
+  Public attributes::
+    count   - number of records written since the buffer was created
+    records - structured numpy array
+    verbs   - command verbs in the order of their codes
+  """
+  dtype = [("time", "f8"), ("verb", "u2"), ("latency", "f4"), ("value", "f4"),
+           ("status", "u1")]
+
+  def __init__(self, size=4096):
+    """
+    @param size : number of records kept
+    @type  size : int
+    """
+    self.records = zeros(size, dtype=self.dtype)
+    self.count = 0
+    self.verbs = []
+    self._codes = {}
+
+  def add(self, timestamp, verb, latency, value=nan, status=OK):
+    """
+    Writes one record, overwriting the oldest if the buffer is full
+    """
+    try:
+      code = self._codes[verb]
+    except KeyError:
+      code = self._codes[verb] = len(self.verbs)
+      self.verbs.append(verb)
+    self.records[self.count % len(self.records)] = (timestamp, code, latency,
+                                                    value, status)
+    self.count += 1
+
+  def dump(self):
+    """
+    Returns a copy of the records, oldest first
+    """
+    size = len(self.records)
+    if self.count <= size:
+      return self.records[:self.count].copy()
+    index = self.count % size
+    return concatenate((self.records[index:], self.records[:index]))
+
+  def save(self, filename):
+    """
+    Writes the records, oldest first, as a .npy file
+
+    The verb codes are saved alongside in a text file ending in '.verbs'.
+    """
+    save(filename, self.dump())
+    with open(filename+".verbs", "w") as fd:
+      fd.write("\n".join(self.verbs)+"\n")
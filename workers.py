@@ -0,0 +1,222 @@
+"""
+Acquisition in worker processes
+
+With many heads in one process the parsing, logging and timestamping of
+the replies compete for the interpreter lock, and epoch jitter grows with
+the number of heads.  A WorkerPool instead reads each head, or all the heads
+on one USB bus, in its own process.  Each worker runs an EpochScheduler at
+the same rate, so all workers start their epochs together on the same
+wall-clock grid without talking to each other, and writes its readings into
+its own sharedmem.SharedReadings file.  The parent, usually the server,
+collects each completed epoch from those files.
+
+The files are created by the parent before the workers are forked, so they
+exist from the start and a worker which dies simply leaves NaNs.  Rate
+changes and stop requests go to the workers through pipes.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from numpy import empty, inf, nan
+
+from Electronics.Instruments.Radipower import find_radipowers, Poller
+from Electronics.Instruments.Radipower.scheduler import EpochScheduler
+from Electronics.Instruments.Radipower.sharedmem import SharedReadings, \
+                                                       SharedReadingsReader
+from Electronics.Instruments.Radipower.sysfs import usb_ports
+
+logger = logging.getLogger(__name__)
+
+def group_ports(ports, by="head"):
+  """
+  Returns lists of ports to be read by one worker each
+
+  @param ports : serial ports
+  @type  ports : list of str
+
+  @param by : 'head' for a worker per port or 'bus' for one per USB bus
+  @type  by : str
+  """
+  if by == "head":
+    return [[port] for port in sorted(ports)]
+  elif by == "bus":
+    adapters = usb_ports()
+    buses = {}
+    for port in sorted(ports):
+      topology = adapters.get(port, {}).get("topology") or ""
+      buses.setdefault(topology.split("-")[0], []).append(port)
+    return [buses[bus] for bus in sorted(buses.keys())]
+  raise ValueError("cannot group ports by %r" % by)
+
+def _control(connection, scheduler):
+  """
+  Passes rate changes from the parent to a worker's scheduler
+
+  A rate of None stops the worker.
+  """
+  while True:
+    try:
+      rate = connection.recv()
+    except EOFError:
+      rate = None
+    if rate == None:
+      scheduler.stop()
+      return
+    scheduler.set_rate(rate)
+
+def _work(ports, writer, rate, connection, kwargs):
+  """
+  Body of a worker process
+
+  @param ports : serial ports of the heads read by this worker
+  @param writer : shared file with a column for each head
+  @param rate : initial epochs per second
+  @param connection : receiving end of the control pipe
+  @param kwargs : keyword arguments for find_radipowers()
+  """
+  name = multiprocessing.current_process().name
+  rp = find_radipowers(ports=ports, **kwargs)
+  poller = Poller(rp)
+  missing = set(writer.keys) - set(poller.keys)
+  if missing:
+    logger.error("%s: heads %s not found", name, sorted(missing))
+  columns = [writer.keys.index(key) for key in poller.keys]
+  scheduler = EpochScheduler(rate)
+  control = threading.Thread(target=_control, args=(connection, scheduler),
+                             name="control")
+  control.daemon = True
+  control.start()
+  row = empty(len(writer.keys))
+  try:
+    while scheduler.wait() != None:
+      timestamp, readings = poller.read()
+      row.fill(nan)
+      row[columns] = readings
+      writer.append(timestamp, row)
+  finally:
+    for head in rp.values():
+      head.close()
+  logger.debug("%s: stopped", name)
+
+
+class WorkerPool(object):
+  """
+  Worker processes reading the heads, and the files they write
+
+  Public attributes::
+    keys    - head indices in the order of the readings returned by read()
+    logger  - logging.Logger object
+    workers - multiprocessing.Process objects
+  """
+  def __init__(self, ports, rate, by="head", **kwargs):
+    """
+    @param ports : head index for each serial port
+    @type  ports : dict of int keyed by str
+
+    @param rate : epochs per second
+    @type  rate : float
+
+    @param by : 'head' or 'bus'; see group_ports()
+    @type  by : str
+
+    Other keyword arguments, e.g. 'cache', are passed to find_radipowers()
+    in the workers.
+    """
+    self.logger = logging.getLogger(logger.name+".WorkerPool")
+    self.keys = sorted(ports.values())
+    if os.path.isdir("/dev/shm"):
+      self._directory = tempfile.mkdtemp(prefix="radiometer-", dir="/dev/shm")
+    else:
+      self._directory = tempfile.mkdtemp(prefix="radiometer-")
+    self.workers = []
+    self._writers = []
+    self._readers = []
+    self._connections = []
+    self._columns = []
+    for number, group in enumerate(group_ports(ports.keys(), by)):
+      keys = [ports[port] for port in group]
+      path = os.path.join(self._directory, "worker%d" % number)
+      writer = SharedReadings(keys, path=path)
+      receiver, sender = multiprocessing.Pipe(duplex=False)
+      worker = multiprocessing.Process(target=_work,
+                                       name="radiometer-worker%d" % number,
+                                       args=(group, writer, rate, receiver,
+                                             kwargs))
+      worker.daemon = True
+      worker.start()
+      receiver.close()
+      self.logger.debug("__init__: %s reads heads %s on %s",
+                        worker.name, keys, group)
+      self.workers.append(worker)
+      self._writers.append(writer)
+      self._readers.append(SharedReadingsReader(path))
+      self._connections.append(sender)
+      self._columns.append([self.keys.index(key) for key in keys])
+
+  def set_rate(self, rate):
+    """
+    Changes the rate of all the workers from their next epoch on
+    """
+    for connection in self._connections:
+      connection.send(rate)
+
+  def read(self, start, stop):
+    """
+    Collects the readings of the epoch between 'start' and 'stop'
+
+    Each worker's last reading timed within the interval is used; heads
+    without one get NaN.  Call this after 'stop', i.e. for the epoch which
+    has just ended.
+
+    @param start : wall-clock start of the epoch
+    @type  start : float
+
+    @param stop : wall-clock start of the next epoch
+    @type  stop : float
+
+    @return: (earliest reading time or 'start', array of readings)
+    """
+    readings = empty(len(self.keys))
+    readings.fill(nan)
+    timestamp = inf
+    for reader, columns in zip(self._readers, self._columns):
+      first, times, power = reader.since(reader.count-4)
+      for index in range(len(times)-1, -1, -1):
+        if start <= times[index] < stop:
+          readings[columns] = power[index]
+          timestamp = min(timestamp, times[index])
+          break
+    if timestamp == inf:
+      timestamp = start
+    return timestamp, readings
+
+  def status(self):
+    """
+    Returns whether each worker is alive, keyed by worker name
+    """
+    return dict([(worker.name, worker.is_alive()) for worker in self.workers])
+
+  def close(self, timeout=5.):
+    """
+    Stops the workers and removes their files
+    """
+    for connection in self._connections:
+      try:
+        connection.send(None)
+      except IOError:
+        pass # worker already gone
+      connection.close()
+    for worker in self.workers:
+      worker.join(timeout)
+      if worker.is_alive():
+        self.logger.warning("close: terminating %s", worker.name)
+        worker.terminate()
+    for reader in self._readers:
+      reader.close()
+    for writer in self._writers:
+      writer.close()
+    shutil.rmtree(self._directory, ignore_errors=True)